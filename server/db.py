@@ -1,24 +1,137 @@
+import os
+
 import chromadb
-from chromadb.utils import embedding_functions
+import numpy as np
+
+from datetime import datetime
+
+from embeddings import get_embedding_store, SharedSTEmbeddingFunction, chunk_time_bounds_ms
+from study_models import record_session_chunk, get_ingested_session_ids, has_ingested_sessions
+from query_batcher import QueryBatcher
+from embedding_cache import get_embedding_cache
 
 # Handles initialization, embeddings, and persistent storage
 
+# HNSW presets by corpus size: (max_vectors, M, construction_ef, search_ef).
+# Larger M means more neighbour links per vector (better recall, ~M * 8 bytes
+# extra memory per vector and slower inserts); larger search_ef trades query
+# latency for recall. At the 10-second ingestion cadence a session adds ~360
+# chunks per hour, so the medium tier is the common steady state.
+# New collections are built with the smallest tier, so the startup retune
+# leaves them alone until they grow into the next one.
+HNSW_TIERS = [
+    (10_000, 24, 128, 100),
+    (100_000, 24, 128, 150),
+    (None, 32, 200, 200),
+]
+
+
+def configure_hnsw_params(vector_count: int) -> dict:
+    """
+    Pick HNSW parameters for the given corpus size.
+
+    CHROMA_HNSW_M, CHROMA_HNSW_EFC and CHROMA_HNSW_EFS override the tier values.
+    """
+    for max_vectors, m, construction_ef, search_ef in HNSW_TIERS:
+        if max_vectors is None or vector_count < max_vectors:
+            break
+
+    return {
+        "hnsw:M": int(os.getenv("CHROMA_HNSW_M", m)),
+        "hnsw:construction_ef": int(os.getenv("CHROMA_HNSW_EFC", construction_ef)),
+        "hnsw:search_ef": int(os.getenv("CHROMA_HNSW_EFS", search_ef)),
+    }
+
+
 client = chromadb.PersistentClient(path="./chroma_db")
 
-embedding_func = embedding_functions.SentenceTransformerEmbeddingFunction(
-    model_name="all-MiniLM-L6-v2"
-)
+# Reuse the EmbeddingStore model instead of loading a second copy
+embedding_func = SharedSTEmbeddingFunction(get_embedding_store())
 
 collection = client.get_or_create_collection(
     name="embedding_storage",
     embedding_function=embedding_func,
     metadata={
-        "hnsw:space": "cosine",
+        # Stored and query vectors are unit-norm (see EmbeddingStore), so
+        # inner-product distance 1 - <q, v> equals cosine distance without
+        # the per-vector normalisation cosine space performs.
+        "hnsw:space": "ip",
+        **configure_hnsw_params(0),
         "description": "Real-time context streaming storage with 10-second batched embeddings"
     }
 )
 
 
+def apply_hnsw_tier():
+    """
+    Re-tune the collection for its current size.
+
+    Only search_ef can change on a live index; M and construction_ef are fixed
+    when the graph is built, so an index that has outgrown them is just reported.
+    """
+    try:
+        params = configure_hnsw_params(collection.count())
+        hnsw_config = (collection.configuration or {}).get("hnsw") or {}
+
+        if hnsw_config.get("ef_search") != params["hnsw:search_ef"]:
+            collection.modify(configuration={"hnsw": {"ef_search": params["hnsw:search_ef"]}})
+
+        if (
+            hnsw_config.get("max_neighbors", 0) < params["hnsw:M"]
+            or hnsw_config.get("ef_construction", 0) < params["hnsw:construction_ef"]
+        ):
+            print(
+                f"[DB] HNSW tier suggests M={params['hnsw:M']}, "
+                f"construction_ef={params['hnsw:construction_ef']}; rebuild the collection to apply"
+            )
+    except Exception as e:
+        print(f"Error configuring HNSW params: {e}")
+
+
+apply_hnsw_tier()
+
+# Shared micro-batcher for concurrent vector searches against the collection
+query_batcher = QueryBatcher(collection)
+
+# Recent query embeddings saved at shutdown and replayed at startup, so the
+# first searches after a restart don't pay for loading the index cold
+HOT_QUERIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "hot_queries.npy")
+HOT_QUERIES_MAX = 1000
+WARMUP_BATCH_SIZE = 100
+
+
+def save_hot_queries(path: str = HOT_QUERIES_PATH):
+    """Persist the most recently used query embeddings for the next startup."""
+    try:
+        embeddings = get_embedding_cache().recent(HOT_QUERIES_MAX)
+        if not len(embeddings):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.save(path, embeddings)
+        print(f"[DB] Saved {len(embeddings)} hot query embeddings")
+    except Exception as e:
+        print(f"Error saving hot queries: {e}")
+
+
+def warm_index(path: str = HOT_QUERIES_PATH):
+    """Replay saved query embeddings so the HNSW segment and hot neighbourhoods are loaded."""
+    try:
+        count = collection.count()
+        if not count or not os.path.exists(path):
+            return
+
+        embeddings = np.load(path)
+        for start in range(0, len(embeddings), WARMUP_BATCH_SIZE):
+            collection.query(
+                query_embeddings=embeddings[start:start + WARMUP_BATCH_SIZE].tolist(),
+                n_results=min(10, count),
+                include=[]
+            )
+        print(f"[DB] Warmed index with {len(embeddings)} hot queries")
+    except Exception as e:
+        print(f"Error warming index: {e}")
+
+
 def query_by_session(session_id: str, n_results: int = 10):
     """Query all chunks from a specific session."""
     return collection.get(
@@ -27,26 +140,52 @@ def query_by_session(session_id: str, n_results: int = 10):
     )
 
 
-def query_by_time_range(start_time: str, end_time: str, n_results: int = 50):
-    """Query chunks within a time range."""
+def query_by_time_range(start_time: float, end_time: float, n_results: int = 50):
+    """Query chunks within a time range (epoch seconds)."""
     return collection.get(
-        where={
-            "start_time": {"$gte": start_time},
-            "end_time": {"$lte": end_time}
-        },
+        where={"$and": [
+            {"start_time_ms": {"$gte": int(start_time * 1000)}},
+            {"end_time_ms": {"$lte": int(end_time * 1000)}}
+        ]},
         limit=n_results
     )
 
 
 def get_session_ids():
-    """Get all unique session IDs in the collection."""
+    """Get all unique session IDs, most recently active first."""
     try:
-        all_data = collection.get(include=["metadatas"])
-        session_ids = set()
-        for metadata in all_data.get("metadatas", []):
-            if metadata and "session_id" in metadata:
-                session_ids.add(metadata["session_id"])
-        return list(session_ids)
+        return get_ingested_session_ids()
     except Exception as e:
         print(f"Error getting session IDs: {e}")
         return []
+
+
+def migrate_session_index():
+    """
+    One-time backfill of the session registry from Chroma metadata.
+
+    Only runs while the registry is empty, so the full metadata scan
+    happens once rather than on every session listing.
+    """
+    try:
+        if has_ingested_sessions():
+            return
+
+        all_data = collection.get(include=["metadatas"])
+        sessions = {}
+        for metadata in all_data.get("metadatas", []):
+            if not metadata or "session_id" not in metadata:
+                continue
+            start_ms, end_ms = chunk_time_bounds_ms(metadata)
+            start = datetime.fromtimestamp(start_ms / 1000)
+            end = datetime.fromtimestamp(end_ms / 1000)
+            first, last, count = sessions.get(metadata["session_id"], (start, end, 0))
+            sessions[metadata["session_id"]] = (min(first, start), max(last, end), count + 1)
+
+        for session_id, (first, last, count) in sessions.items():
+            record_session_chunk(session_id, first, last, chunks=count)
+
+        if sessions:
+            print(f"[DB] Backfilled {len(sessions)} sessions into the session index")
+    except Exception as e:
+        print(f"Error migrating session index: {e}")
@@ -0,0 +1,73 @@
+"""
+Query Embedding Cache
+
+Remembers the embedding of recently seen query strings so a repeated
+question is encoded once, whichever endpoint or filter it comes through.
+"""
+
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 2000))
+EMBEDDING_CACHE_TTL_SEC = float(os.getenv("EMBEDDING_CACHE_TTL_SEC", 3600))
+
+
+class EmbeddingCache:
+    """Thread-safe LRU of text -> embedding, keyed by SHA-256 of the text."""
+
+    def __init__(self, max_size: int = EMBEDDING_CACHE_SIZE, ttl_sec: float = EMBEDDING_CACHE_TTL_SEC):
+        self.max_size = max_size
+        self.ttl_sec = ttl_sec
+        self._entries: OrderedDict[str, tuple[float, np.ndarray]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(text: str) -> str:
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """Return the cached embedding for a text, or None."""
+        key = self._key(text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl_sec:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, text: str, embedding: np.ndarray):
+        """Store an embedding, evicting the least recently used entry when full."""
+        key = self._key(text)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def recent(self, limit: int) -> np.ndarray:
+        """Up to `limit` most recently used embeddings as an (N, dim) array."""
+        with self._lock:
+            embeddings = [entry[1] for entry in list(self._entries.values())[-limit:]]
+        return np.stack(embeddings) if embeddings else np.empty((0, 0), dtype=np.float32)
+
+
+# Global embedding cache instance
+embedding_cache = EmbeddingCache()
+
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Get the global embedding cache instance."""
+    return embedding_cache
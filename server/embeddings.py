@@ -0,0 +1,389 @@
+"""
+Embedding Store
+
+Owns the SentenceTransformer model used for context embeddings and
+encodes texts in batches so a flush costs one forward pass, not one per chunk.
+"""
+
+import os
+import asyncio
+from itertools import count
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+import torch
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from sentence_transformers import SentenceTransformer
+
+from embedding_cache import get_embedding_cache
+
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+ENCODE_BATCH_SIZE = 32
+
+# "onnx" runs the encoder on ONNX Runtime (needs sentence-transformers[onnx]);
+# the default file is the int8 dynamically-quantized export for AVX-512 VNNI CPUs.
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_qint8_avx512_vnni.onnx")
+
+# PyTorch backend precision: "auto" uses fp16 on CUDA and fp32 on CPU;
+# "bf16" is worth enabling on CPUs with AVX-512 BF16 / AMX.
+EMBEDDING_DTYPE = os.getenv("EMBEDDING_DTYPE", "auto")
+
+# asearch_embeddings fetches this many times the requested results from HNSW
+# and reranks them exactly, trading a larger candidate set for recall
+RERANK_OVERFETCH = 4
+
+# Header for each retrieved chunk in the RAG prompt context
+_CONTEXT_TEMPLATE = "[Context {}]:\n{}"
+
+# A single encode already spreads over every core; running several at once
+# only makes their thread pools fight. Serialise on CPU, allow a few on CUDA.
+torch.set_num_threads(os.cpu_count() or 1)
+try:
+    torch.set_num_interop_threads(1)
+except RuntimeError:
+    pass  # Can only be set before any inter-op parallel work has started
+
+MAX_EMBEDDING_CONCURRENCY = int(os.getenv(
+    "MAX_EMBEDDING_CONCURRENCY",
+    4 if torch.cuda.is_available() else 1
+))
+_ENCODE_SEM = asyncio.Semaphore(MAX_EMBEDDING_CONCURRENCY)
+
+
+def _load_model(model_name: str, backend: str = EMBEDDING_BACKEND) -> SentenceTransformer:
+    """Load the encoder, falling back to PyTorch if the ONNX backend fails."""
+    if backend == "onnx":
+        try:
+            model = SentenceTransformer(
+                model_name,
+                backend="onnx",
+                model_kwargs={"file_name": EMBEDDING_ONNX_FILE}
+            )
+            print(f"[Embeddings] Loaded {model_name} on ONNX Runtime ({EMBEDDING_ONNX_FILE})")
+            return model
+        except Exception as e:
+            print(f"[Embeddings] ONNX backend failed ({e}), falling back to PyTorch")
+
+    return _apply_precision(SentenceTransformer(model_name))
+
+
+def _apply_precision(model: SentenceTransformer, dtype: str = EMBEDDING_DTYPE) -> SentenceTransformer:
+    """Run the PyTorch encoder in half precision where it pays off."""
+    if model.device.type == "cuda" and dtype in ("auto", "fp16"):
+        return model.half()
+    if dtype == "bf16":
+        return model.to(torch.bfloat16)
+    return model
+
+
+def rerank_cosine(query: np.ndarray, mat: np.ndarray) -> np.ndarray:
+    """Exact cosine scores of unit-norm rows against a unit-norm query."""
+    # Stored vectors are normalised at insert, so cosine is a plain inner product.
+    # For rerank-sized inputs (tens to a few thousand 384-d rows) the BLAS sgemv
+    # here beat simsimd.cdist at every size measured; don't swap it in without
+    # re-benchmarking.
+    return mat @ query.astype(np.float32, copy=False)
+
+
+def chunk_time_bounds_ms(metadata: dict) -> tuple[int, int]:
+    """Chunk start/end as epoch milliseconds (also reads legacy ISO metadata)."""
+    if "start_time_ms" in metadata:
+        return metadata["start_time_ms"], metadata["end_time_ms"]
+
+    start, end = metadata.get("start_time"), metadata.get("end_time")
+    return (
+        int(datetime.fromisoformat(start).timestamp() * 1000) if start else 0,
+        int(datetime.fromisoformat(end).timestamp() * 1000) if end else 0
+    )
+
+
+def with_iso_times(metadata: Optional[dict]) -> dict:
+    """Copy of chunk metadata with ISO start_time/end_time filled in for API responses."""
+    if not metadata or "start_time_ms" not in metadata:
+        return dict(metadata or {})
+
+    return {
+        **metadata,
+        "start_time": datetime.fromtimestamp(metadata["start_time_ms"] / 1000).isoformat(),
+        "end_time": datetime.fromtimestamp(metadata["end_time_ms"] / 1000).isoformat()
+    }
+
+
+def format_sources(results: dict) -> tuple[list[dict], str]:
+    """
+    Turn a single-query search result into (API sources, combined prompt context).
+
+    Distances are inner-product distances on unit vectors, so relevance is 1 - distance.
+    """
+    documents = (results.get("documents") or [[]])[0]
+    metadatas = (results.get("metadatas") or [[]])[0] or [None] * len(documents)
+    distances = (results.get("distances") or [[]])[0] or [0.0] * len(documents)
+
+    sources = []
+    for i, meta, dist in zip(count(), map(with_iso_times, metadatas), distances):
+        sources.append({
+            "id": i,
+            "start_time": meta.get("start_time", ""),
+            "end_time": meta.get("end_time", ""),
+            "session_id": meta.get("session_id", ""),
+            "relevance_score": 1 - dist
+        })
+
+    return sources, "\n\n".join(map(_CONTEXT_TEMPLATE.format, count(1), documents))
+
+
+class EmbeddingStore:
+    """
+    Batched embedding generation for ChromaDB writes.
+
+    Items are dicts with "id", "text" and optional "metadata" keys.
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME):
+        self.model_name = model_name
+        self.model = _load_model(model_name)
+
+    def _encode_batch(self, texts: list[str]) -> np.ndarray:
+        """
+        Encode texts in a single batched forward pass.
+
+        Vectors are always L2-normalised; the collections use inner-product
+        distance and rely on this to match cosine similarity.
+        """
+        # encode() already length-sorts inputs before batching and restores the
+        # original order afterwards, so mixed frame/transcript lengths pad only
+        # to their neighbours. Don't pre-sort here; results stay aligned with items.
+        embeddings = self.model.encode(
+            texts,
+            batch_size=ENCODE_BATCH_SIZE,
+            show_progress_bar=False,
+            convert_to_numpy=True
+        ).astype(np.float32, copy=False)  # Keep Chroma storage fp32 under fp16/bf16
+
+        # Normalise once here, in fp32: doing it in the model's fp16/bf16 leaves
+        # norms off by ~1e-3, which skews inner-product distances
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12
+        return embeddings
+
+    def embed_query(self, text: str) -> np.ndarray:
+        """Embedding of a search query, served from the query embedding cache when possible."""
+        cache = get_embedding_cache()
+        embedding = cache.get(text)
+        if embedding is None:
+            embedding = self._encode_batch([text])[0]
+            embedding.setflags(write=False)  # Shared between callers
+            cache.put(text, embedding)
+        return embedding
+
+    async def aembed_query(self, text: str) -> np.ndarray:
+        """Async embed_query; a cache miss encodes under _ENCODE_SEM like any other encode."""
+        cache = get_embedding_cache()
+        embedding = cache.get(text)
+        if embedding is None:
+            embedding = (await self._run_encode(self._encode_batch, [text]))[0]
+            embedding.setflags(write=False)  # Shared between callers
+            cache.put(text, embedding)
+        return embedding
+
+    def upsert_embeddings(self, collection, items: list[dict], embeddings: np.ndarray) -> int:
+        """
+        Write items with precomputed embeddings in a single collection.upsert.
+
+        Upserting keeps re-ingestion of an existing chunk ID idempotent
+        instead of failing the whole batch on a duplicate.
+
+        Returns:
+            Number of items written
+        """
+        if not items:
+            return 0
+
+        collection.upsert(
+            ids=[item["id"] for item in items],
+            embeddings=embeddings.tolist(),
+            documents=[item["text"] for item in items],
+            metadatas=[item.get("metadata") for item in items]
+        )
+        return len(items)
+
+    async def _run_encode(self, func, *args):
+        """Run a blocking encode call in the executor, bounded by _ENCODE_SEM."""
+        async with _ENCODE_SEM:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, func, *args)
+
+    async def aencode(self, texts: list[str]) -> np.ndarray:
+        """
+        Async batched encode, bounded by _ENCODE_SEM.
+
+        When several encodes may run at once, large inputs are split into
+        length-sorted micro-batches that run concurrently; each one pads only
+        to texts of similar length. Rows come back in input order.
+        """
+        if MAX_EMBEDDING_CONCURRENCY <= 1 or len(texts) <= ENCODE_BATCH_SIZE:
+            return await self._run_encode(self._encode_batch, texts)
+
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        batches = [order[i:i + ENCODE_BATCH_SIZE] for i in range(0, len(order), ENCODE_BATCH_SIZE)]
+        results = await asyncio.gather(*(
+            self._run_encode(self._encode_batch, [texts[i] for i in batch])
+            for batch in batches
+        ))
+
+        embeddings = np.empty((len(texts), results[0].shape[1]), dtype=np.float32)
+        for batch, result in zip(batches, results):
+            embeddings[batch] = result
+        return embeddings
+
+    async def asearch_embeddings(
+        self,
+        batcher,
+        query: str,
+        limit: int = 5,
+        where: Optional[dict] = None
+    ) -> dict:
+        """
+        High-recall search: over-fetch candidates from HNSW, rerank by exact cosine.
+
+        The Chroma query goes through a QueryBatcher so concurrent searches
+        share a round-trip. Returns a dict shaped like a single-query
+        collection.query() result (documents/metadatas/distances/ids nested
+        one level), best match first.
+        """
+        query_vec = await self.aembed_query(query)
+        results = await batcher.submit(
+            query_vec.tolist(),
+            limit * RERANK_OVERFETCH,
+            where=where,
+            include=("embeddings", "documents", "metadatas", "distances")
+        )
+        return self._rerank(query_vec, results, limit)
+
+    @staticmethod
+    def _rerank(query_vec: np.ndarray, results: dict, limit: int) -> dict:
+        """Keep the top `limit` candidates of a query result by exact cosine score."""
+        ids = results["ids"][0]
+        if not ids:
+            return {"ids": [[]], "documents": [[]], "metadatas": [[]], "distances": [[]]}
+
+        # One contiguous (N, dim) float32 matrix so the scores are a single BLAS matvec
+        candidates = np.ascontiguousarray(results["embeddings"][0], dtype=np.float32)
+        scores = rerank_cosine(query_vec, candidates)
+
+        k = min(limit, len(ids))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        documents = results["documents"][0]
+        metadatas = results["metadatas"][0]
+        return {
+            "ids": [[ids[i] for i in top]],
+            "documents": [[documents[i] for i in top]],
+            "metadatas": [[metadatas[i] for i in top]],
+            "distances": [[1.0 - float(scores[i]) for i in top]]
+        }
+
+    def get_embeddings(
+        self,
+        collection,
+        session_id: Optional[str] = None,
+        limit: Optional[int] = None,
+        include_embeddings: bool = False
+    ) -> list[dict]:
+        """
+        List stored chunks, newest first.
+
+        Args:
+            collection: ChromaDB collection to read from
+            session_id: Optional session filter
+            limit: Maximum number of chunks to return
+            include_embeddings: Include the raw vectors in the output
+        """
+        include = ["documents", "metadatas"]
+        if include_embeddings:
+            include.append("embeddings")
+
+        results = collection.get(
+            where={"session_id": session_id} if session_id else None,
+            include=include
+        )
+
+        ids = results["ids"]
+        documents = results.get("documents") or [""] * len(ids)
+        metadatas = results.get("metadatas") or [None] * len(ids)
+        embs = results.get("embeddings")
+        if embs is None:
+            embs = [None] * len(ids)
+
+        # Sort on a flat array with argsort instead of a Python comparator over dicts
+        start_times = np.fromiter(
+            (chunk_time_bounds_ms(meta or {})[0] for meta in metadatas),
+            dtype=np.int64,
+            count=len(ids)
+        )
+        order = np.argsort(-start_times, kind="stable")[:limit]
+
+        return [
+            {
+                "id": ids[i],
+                "text": documents[i],
+                "metadata": with_iso_times(metadatas[i]),
+                "embedding": list(map(float, embs[i])) if embs[i] is not None else []
+            }
+            for i in order
+        ]
+
+
+class SharedSTEmbeddingFunction(EmbeddingFunction[Documents]):
+    """
+    ChromaDB embedding function that reuses the EmbeddingStore model.
+
+    Registers under Chroma's "sentence_transformer" name with the same config
+    keys, so collections persisted with SentenceTransformerEmbeddingFunction
+    open without an embedding function conflict (and vice versa).
+    """
+
+    def __init__(self, store: EmbeddingStore):
+        self.store = store
+
+    def __call__(self, input: Documents) -> Embeddings:
+        return self.store._encode_batch(list(input)).tolist()
+
+    @staticmethod
+    def name() -> str:
+        return "sentence_transformer"
+
+    def get_config(self) -> dict:
+        return {
+            "model_name": self.store.model_name,
+            "device": str(self.store.model.device),
+            "normalize_embeddings": True,  # _encode_batch always L2-normalises
+            "kwargs": {}
+        }
+
+    @staticmethod
+    def build_from_config(config: dict) -> "SharedSTEmbeddingFunction":
+        return SharedSTEmbeddingFunction(get_embedding_store())
+
+    def default_space(self) -> str:
+        return "ip"
+
+    def supported_spaces(self) -> list[str]:
+        return ["cosine", "l2", "ip"]
+
+    def validate_config_update(self, old_config: dict, new_config: dict) -> None:
+        return
+
+
+# Global embedding store instance (model is loaded on first use)
+_embedding_store: Optional[EmbeddingStore] = None
+
+
+def get_embedding_store() -> EmbeddingStore:
+    """Get the global embedding store instance."""
+    global _embedding_store
+    if _embedding_store is None:
+        _embedding_store = EmbeddingStore()
+    return _embedding_store
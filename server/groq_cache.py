@@ -0,0 +1,105 @@
+"""
+Semantic Cache for Groq RAG Queries
+
+Reuses a previous Groq answer when a near-identical question is asked
+against the same retrieved context, skipping the round-trip and token cost.
+"""
+
+import os
+import json
+import time
+import uuid
+import hashlib
+from typing import Optional
+
+from db import client
+from embeddings import get_embedding_store
+from groq_service import GroqResponse
+
+# Distance (1 - cosine similarity) below which two questions count as the same
+CACHE_DISTANCE_THRESHOLD = 0.05
+CACHE_TTL_SEC = float(os.getenv("GROQ_CACHE_TTL_SEC", 3600))
+
+
+class SemanticGroqCache:
+    """
+    Chroma-backed cache of Groq responses.
+
+    Entries are bucketed by a hash of (retrieved_context, model) and matched
+    on the embedding of the user query within that bucket.
+    """
+
+    def __init__(
+        self,
+        threshold: float = CACHE_DISTANCE_THRESHOLD,
+        ttl_sec: float = CACHE_TTL_SEC
+    ):
+        self.threshold = threshold
+        self.ttl_sec = ttl_sec
+        self.collection = client.get_or_create_collection(
+            name="groq_query_cache",
+            embedding_function=None,
+            metadata={"hnsw:space": "ip"}  # Query embeddings are unit-norm
+        )
+
+    def make_key(self, user_query: str, retrieved_context: str, model: str) -> tuple[list[float], str]:
+        """Compute the (query embedding, context hash) lookup key."""
+        ctx_hash = hashlib.sha256(f"{model}\0{retrieved_context}".encode()).hexdigest()
+        return get_embedding_store().embed_query(user_query).tolist(), ctx_hash
+
+    async def amake_key(self, user_query: str, retrieved_context: str, model: str) -> tuple[list[float], str]:
+        """Async make_key; the query encode shares the embedding store's concurrency bound."""
+        ctx_hash = hashlib.sha256(f"{model}\0{retrieved_context}".encode()).hexdigest()
+        embedding = await get_embedding_store().aembed_query(user_query)
+        return embedding.tolist(), ctx_hash
+
+    def get(self, key: tuple[list[float], str]) -> Optional[GroqResponse]:
+        """Return the cached response for a key, or None on a miss."""
+        embedding, ctx_hash = key
+        try:
+            results = self.collection.query(
+                query_embeddings=[embedding],
+                n_results=1,
+                where={"$and": [
+                    {"ctx_hash": ctx_hash},
+                    {"created_at": {"$gte": time.time() - self.ttl_sec}}
+                ]},
+                include=["metadatas", "distances"]
+            )
+        except Exception as e:
+            print(f"[GroqCache] Lookup failed: {e}")
+            return None
+
+        distances = results.get("distances", [[]])[0]
+        if not distances or distances[0] >= self.threshold:
+            return None
+
+        cached = json.loads(results["metadatas"][0][0]["response"])
+        return GroqResponse(
+            content=cached["content"],
+            model=cached["model"],
+            usage=cached["usage"],
+            success=True
+        )
+
+    def put(self, key: tuple[list[float], str], response: GroqResponse):
+        """Store a successful response and drop expired entries."""
+        embedding, ctx_hash = key
+        now = time.time()
+        try:
+            self.collection.add(
+                ids=[str(uuid.uuid4())],
+                embeddings=[embedding],
+                metadatas=[{
+                    "ctx_hash": ctx_hash,
+                    "created_at": now,
+                    "response": json.dumps({
+                        "content": response.content,
+                        "model": response.model,
+                        "usage": response.usage
+                    })
+                }]
+            )
+            self.collection.delete(where={"created_at": {"$lt": now - self.ttl_sec}})
+        except Exception as e:
+            print(f"[GroqCache] Store failed: {e}")
@@ -6,10 +6,80 @@ Uses Groq's fast inference API with Llama3 or other available models.
 """
 
 import os
-import json
-from typing import Optional
+import re
+import time
+import asyncio
+from typing import Optional, AsyncIterator, Union
 from dataclasses import dataclass
-from groq import Groq
+import orjson
+from groq import Groq, AsyncGroq, RateLimitError
+
+# JSON mode: Groq constrains decoding to a single valid JSON object
+# (the system prompt must mention JSON, which the flashcard/analyze prompts do)
+_JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
+# Fallback for replies that still arrive wrapped in prose or code fences
+_JSON_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+# System prompts are module constants so every request starts with a
+# byte-identical prefix, which Groq's prompt caching can reuse.
+_DEFAULT_SYSTEM_PROMPT = """You are an intelligent study assistant helping users understand their screen content and learning materials.
+
+You have access to retrieved context from the user's recent screen activity and audio transcripts. Use this context to provide accurate, helpful answers.
+
+Guidelines:
+- Base your answers primarily on the retrieved context
+- If the context doesn't contain relevant information, say so clearly
+- Provide clear, concise explanations
+- Use examples when helpful
+- If asked about something outside the context, acknowledge the limitation"""
+
+_FLASHCARD_SYSTEM_PROMPT = """You are an expert educational content creator. Generate high-quality flashcards from the provided content.
+
+Output ONLY valid JSON in this exact format:
+{
+    "flashcards": [
+        {
+            "question": "Clear, specific question",
+            "answer": "Concise, accurate answer",
+            "difficulty": "easy|medium|hard",
+            "topic": "Brief topic tag"
+        }
+    ]
+}
+
+Guidelines:
+- Questions should be clear and unambiguous
+- Answers should be concise but complete
+- Vary difficulty levels appropriately
+- Include relevant topic tags"""
+
+_ANALYZE_SYSTEM_PROMPT = """Analyze the provided content and extract structured information.
+
+Output ONLY valid JSON in this exact format:
+{
+    "topics": ["topic1", "topic2"],
+    "difficulty_score": 1-10,
+    "key_concepts": ["concept1", "concept2"],
+    "summary": "Brief 1-2 sentence summary"
+}
+
+Guidelines:
+- Topics should be broad categories
+- Difficulty: 1 (very easy) to 10 (expert level)
+- Key concepts are specific ideas/terms
+- Summary captures the main point"""
+
+_STUDY_SYSTEM_PROMPT = """You are an expert educator creating comprehensive study materials.
+
+Generate well-structured study notes in Markdown format including:
+- Key concepts with clear explanations
+- Important definitions
+- Examples where applicable
+- Common pitfalls or misconceptions
+- Summary section
+
+Format with proper Markdown headers, bullet points, and code blocks where appropriate."""
 
 
 @dataclass
@@ -20,6 +90,7 @@ class GroqResponse:
     usage: dict
     success: bool
     error: Optional[str] = None
+    data: Optional[dict] = None  # Parsed JSON for JSON-producing calls
 
 
 class GroqService:
@@ -37,16 +108,114 @@ class GroqService:
     DEFAULT_MODEL = "llama-3.1-70b-versatile"
     FAST_MODEL = "llama-3.1-8b-instant"
     
+    # Retries for rate-limited (429) async calls
+    MAX_RETRIES = 3
+    
+    # httpx closes idle keep-alive connections after 5 seconds
+    KEEPALIVE_SEC = 5.0
+    
     def __init__(self, api_key: Optional[str] = None):
         self.api_key = api_key or os.getenv("GROQ_API_KEY")
         self.client: Optional[Groq] = None
+        self.aclient: Optional[AsyncGroq] = None
         self.is_available = bool(self.api_key)
+        # Optional SemanticGroqCache for query_groq, attached by the app
+        self.cache = None
+        self._last_request = 0.0
         
         if self.is_available:
             self.client = Groq(api_key=self.api_key)
+            self.aclient = AsyncGroq(api_key=self.api_key)
         else:
             print("[Groq] API key not configured, running in local-only mode")
     
+    @staticmethod
+    def _not_configured() -> GroqResponse:
+        """Response returned when no API key is set."""
+        return GroqResponse(
+            content="",
+            model="",
+            usage={},
+            success=False,
+            error="Groq API key not configured"
+        )
+    
+    @staticmethod
+    def _to_response(
+        response,
+        content: Optional[str] = None,
+        data: Optional[dict] = None
+    ) -> GroqResponse:
+        """Wrap a chat completion in a GroqResponse."""
+        return GroqResponse(
+            content=response.choices[0].message.content if content is None else content,
+            model=response.model,
+            usage={
+                "prompt_tokens": response.usage.prompt_tokens,
+                "completion_tokens": response.usage.completion_tokens,
+                "total_tokens": response.usage.total_tokens
+            },
+            success=True,
+            data=data
+        )
+    
+    @staticmethod
+    def _extract_json(content: str) -> str:
+        """Strip any text (e.g. markdown code fences) around a JSON object."""
+        stripped = content.strip()
+        if stripped.startswith('{') and stripped.endswith('}'):
+            return stripped
+        
+        json_match = _JSON_RE.search(content)
+        return json_match.group(0) if json_match else content
+    
+    @staticmethod
+    def _parse_json(content: str) -> Optional[dict]:
+        """Parse extracted JSON, returning None if it isn't a valid object."""
+        try:
+            data = orjson.loads(content)
+        except orjson.JSONDecodeError:
+            return None
+        return data if isinstance(data, dict) else None
+    
+    async def _acreate_with_retry(self, **kwargs):
+        """
+        Async chat completion with backoff on 429s.
+        
+        Waits for the server's Retry-After header when present,
+        otherwise backs off exponentially.
+        """
+        for attempt in range(self.MAX_RETRIES + 1):
+            try:
+                self._last_request = time.monotonic()
+                return await self.aclient.chat.completions.create(**kwargs)
+            except RateLimitError as e:
+                if attempt == self.MAX_RETRIES:
+                    raise
+                retry_after = e.response.headers.get("retry-after")
+                try:
+                    delay = float(retry_after)
+                except (TypeError, ValueError):
+                    delay = 2 ** attempt
+                await asyncio.sleep(delay)
+    
+    async def aensure_session(self):
+        """
+        Open the pooled HTTPS connection ahead of a completion.
+        
+        After an idle gap the next call would pay DNS + TLS setup; callers
+        start this alongside their own work (e.g. retrieval) so that cost
+        overlaps it. No-op while the connection is still warm.
+        """
+        if not self.aclient or time.monotonic() - self._last_request < self.KEEPALIVE_SEC:
+            return
+        
+        self._last_request = time.monotonic()
+        try:
+            await self.aclient.models.list()
+        except Exception as e:
+            print(f"[Groq] Connection warm-up failed: {e}")
+    
     def query_groq(
         self,
         user_query: str,
@@ -67,57 +236,72 @@ class GroqService:
             GroqResponse with the AI's answer
         """
         if not self.client:
+            return self._not_configured()
+        
+        model = model or self.DEFAULT_MODEL
+        
+        # Only default-prompt queries are cached; a custom prompt changes the answer
+        cache_key = None
+        if self.cache and system_prompt is None:
+            cache_key = self.cache.make_key(user_query, retrieved_context, model)
+            cached = self.cache.get(cache_key)
+            if cached:
+                return cached
+        
+        try:
+            response = self.client.chat.completions.create(
+                model=model,
+                messages=self._query_messages(user_query, retrieved_context, system_prompt),
+                temperature=0.7,
+                max_tokens=1024
+            )
+            
+            result = self._to_response(response)
+            if cache_key:
+                self.cache.put(cache_key, result)
+            return result
+            
+        except Exception as e:
             return GroqResponse(
                 content="",
                 model="",
                 usage={},
                 success=False,
-                error="Groq API key not configured"
+                error=str(e)
             )
+    
+    async def aquery_groq(
+        self,
+        user_query: str,
+        retrieved_context: str,
+        model: Optional[str] = None,
+        system_prompt: Optional[str] = None
+    ) -> GroqResponse:
+        """Async variant of query_groq."""
+        if not self.aclient:
+            return self._not_configured()
+        
+        model = model or self.DEFAULT_MODEL
+        
+        cache_key = None
+        if self.cache and system_prompt is None:
+            cache_key = await self.cache.amake_key(user_query, retrieved_context, model)
+            cached = await asyncio.to_thread(self.cache.get, cache_key)
+            if cached:
+                return cached
         
-        # Default system prompt for RAG queries
-        if system_prompt is None:
-            system_prompt = """You are an intelligent study assistant helping users understand their screen content and learning materials.
-
-You have access to retrieved context from the user's recent screen activity and audio transcripts. Use this context to provide accurate, helpful answers.
-
-Guidelines:
-- Base your answers primarily on the retrieved context
-- If the context doesn't contain relevant information, say so clearly
-- Provide clear, concise explanations
-- Use examples when helpful
-- If asked about something outside the context, acknowledge the limitation"""
-
-        # Build the user message with context
-        user_message = f"""Retrieved Context:
-{retrieved_context}
-
----
-User Question: {user_query}
-
-Please answer based on the context above. If the context doesn't contain relevant information, let me know."""
-
         try:
-            response = self.client.chat.completions.create(
-                model=model or self.DEFAULT_MODEL,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
+            response = await self._acreate_with_retry(
+                model=model,
+                messages=self._query_messages(user_query, retrieved_context, system_prompt),
                 temperature=0.7,
                 max_tokens=1024
             )
             
-            return GroqResponse(
-                content=response.choices[0].message.content,
-                model=response.model,
-                usage={
-                    "prompt_tokens": response.usage.prompt_tokens,
-                    "completion_tokens": response.usage.completion_tokens,
-                    "total_tokens": response.usage.total_tokens
-                },
-                success=True
-            )
+            result = self._to_response(response)
+            if cache_key:
+                await asyncio.to_thread(self.cache.put, cache_key, result)
+            return result
             
         except Exception as e:
             return GroqResponse(
@@ -128,6 +312,31 @@ Please answer based on the context above. If the context doesn't contain relevan
                 error=str(e)
             )
     
+    @staticmethod
+    def _query_messages(
+        user_query: str,
+        retrieved_context: str,
+        system_prompt: Optional[str] = None
+    ) -> list[dict]:
+        """Build the chat messages for a RAG query."""
+        # Default system prompt for RAG queries
+        if system_prompt is None:
+            system_prompt = _DEFAULT_SYSTEM_PROMPT
+
+        # Build the user message with context
+        user_message = f"""Retrieved Context:
+{retrieved_context}
+
+---
+User Question: {user_query}
+
+Please answer based on the context above. If the context doesn't contain relevant information, let me know."""
+
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_message}
+        ]
+    
     def generate_flashcards(
         self,
         context: str,
@@ -146,73 +355,50 @@ Please answer based on the context above. If the context doesn't contain relevan
             GroqResponse with flashcards in JSON format
         """
         if not self.client:
+            return self._not_configured()
+        
+        try:
+            response = self.client.chat.completions.create(
+                model=model or self.DEFAULT_MODEL,
+                messages=self._flashcard_messages(context, count),
+                temperature=0.7,
+                max_tokens=2048,
+                response_format=_JSON_RESPONSE_FORMAT
+            )
+            
+            content = self._extract_json(response.choices[0].message.content)
+            return self._to_response(response, content, self._parse_json(content))
+            
+        except Exception as e:
             return GroqResponse(
                 content="",
                 model="",
                 usage={},
                 success=False,
-                error="Groq API key not configured"
+                error=str(e)
             )
+    
+    async def agenerate_flashcards(
+        self,
+        context: str,
+        count: int = 5,
+        model: Optional[str] = None
+    ) -> GroqResponse:
+        """Async variant of generate_flashcards."""
+        if not self.aclient:
+            return self._not_configured()
         
-        system_prompt = """You are an expert educational content creator. Generate high-quality flashcards from the provided content.
-
-Output ONLY valid JSON in this exact format:
-{
-    "flashcards": [
-        {
-            "question": "Clear, specific question",
-            "answer": "Concise, accurate answer",
-            "difficulty": "easy|medium|hard",
-            "topic": "Brief topic tag"
-        }
-    ]
-}
-
-Guidelines:
-- Questions should be clear and unambiguous
-- Answers should be concise but complete
-- Vary difficulty levels appropriately
-- Include relevant topic tags"""
-
-        user_message = f"""Generate {count} flashcards from the following content:
-
-{context}
-
-Output ONLY the JSON, no additional text."""
-
         try:
-            response = self.client.chat.completions.create(
+            response = await self._acreate_with_retry(
                 model=model or self.DEFAULT_MODEL,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
+                messages=self._flashcard_messages(context, count),
                 temperature=0.7,
-                max_tokens=2048
+                max_tokens=2048,
+                response_format=_JSON_RESPONSE_FORMAT
             )
             
-            content = response.choices[0].message.content
-            
-            # Try to extract JSON from the response
-            try:
-                # Find JSON in the response (handle markdown code blocks)
-                import re
-                json_match = re.search(r'\{[\s\S]*\}', content)
-                if json_match:
-                    content = json_match.group(0)
-            except:
-                pass
-            
-            return GroqResponse(
-                content=content,
-                model=response.model,
-                usage={
-                    "prompt_tokens": response.usage.prompt_tokens,
-                    "completion_tokens": response.usage.completion_tokens,
-                    "total_tokens": response.usage.total_tokens
-                },
-                success=True
-            )
+            content = self._extract_json(response.choices[0].message.content)
+            return self._to_response(response, content, self._parse_json(content))
             
         except Exception as e:
             return GroqResponse(
@@ -223,6 +409,47 @@ Output ONLY the JSON, no additional text."""
                 error=str(e)
             )
     
+    async def abatch_generate_flashcards(
+        self,
+        contexts: list[str],
+        count: int = 5,
+        model: Optional[str] = None,
+        max_concurrency: int = 5
+    ) -> list[GroqResponse]:
+        """
+        Generate flashcards for many contexts concurrently.
+        
+        Args:
+            contexts: Content chunks to generate flashcards from
+            count: Number of flashcards per context
+            model: Optional model override
+            max_concurrency: Maximum in-flight requests
+            
+        Returns:
+            One GroqResponse per context, in input order
+        """
+        sem = asyncio.Semaphore(max_concurrency)
+        
+        async def generate(context: str) -> GroqResponse:
+            async with sem:
+                return await self.agenerate_flashcards(context, count, model)
+        
+        return await asyncio.gather(*(generate(context) for context in contexts))
+    
+    @staticmethod
+    def _flashcard_messages(context: str, count: int) -> list[dict]:
+        """Build the chat messages for flashcard generation."""
+        user_message = f"""Generate {count} flashcards from the following content:
+
+{context}
+
+Output ONLY the JSON, no additional text."""
+
+        return [
+            {"role": "system", "content": _FLASHCARD_SYSTEM_PROMPT},
+            {"role": "user", "content": user_message}
+        ]
+    
     def analyze_content(
         self,
         context: str,
@@ -239,30 +466,8 @@ Output ONLY the JSON, no additional text."""
             GroqResponse with analysis in JSON format
         """
         if not self.client:
-            return GroqResponse(
-                content="",
-                model="",
-                usage={},
-                success=False,
-                error="Groq API key not configured"
-            )
+            return self._not_configured()
         
-        system_prompt = """Analyze the provided content and extract structured information.
-
-Output ONLY valid JSON in this exact format:
-{
-    "topics": ["topic1", "topic2"],
-    "difficulty_score": 1-10,
-    "key_concepts": ["concept1", "concept2"],
-    "summary": "Brief 1-2 sentence summary"
-}
-
-Guidelines:
-- Topics should be broad categories
-- Difficulty: 1 (very easy) to 10 (expert level)
-- Key concepts are specific ideas/terms
-- Summary captures the main point"""
-
         user_message = f"""Analyze this content:
 
 {context}
@@ -273,34 +478,16 @@ Output ONLY the JSON, no additional text."""
             response = self.client.chat.completions.create(
                 model=model or self.FAST_MODEL,
                 messages=[
-                    {"role": "system", "content": system_prompt},
+                    {"role": "system", "content": _ANALYZE_SYSTEM_PROMPT},
                     {"role": "user", "content": user_message}
                 ],
                 temperature=0.3,
-                max_tokens=512
+                max_tokens=512,
+                response_format=_JSON_RESPONSE_FORMAT
             )
             
-            content = response.choices[0].message.content
-            
-            # Try to extract JSON
-            try:
-                import re
-                json_match = re.search(r'\{[\s\S]*\}', content)
-                if json_match:
-                    content = json_match.group(0)
-            except:
-                pass
-            
-            return GroqResponse(
-                content=content,
-                model=response.model,
-                usage={
-                    "prompt_tokens": response.usage.prompt_tokens,
-                    "completion_tokens": response.usage.completion_tokens,
-                    "total_tokens": response.usage.total_tokens
-                },
-                success=True
-            )
+            content = self._extract_json(response.choices[0].message.content)
+            return self._to_response(response, content, self._parse_json(content))
             
         except Exception as e:
             return GroqResponse(
@@ -327,50 +514,45 @@ Output ONLY the JSON, no additional text."""
             GroqResponse with study materials in markdown format
         """
         if not self.client:
+            return self._not_configured()
+        
+        try:
+            response = self.client.chat.completions.create(
+                model=model or self.DEFAULT_MODEL,
+                messages=self._study_messages(context),
+                temperature=0.7,
+                max_tokens=4096
+            )
+            
+            return self._to_response(response)
+            
+        except Exception as e:
             return GroqResponse(
                 content="",
                 model="",
                 usage={},
                 success=False,
-                error="Groq API key not configured"
+                error=str(e)
             )
+    
+    async def agenerate_study_materials(
+        self,
+        context: str,
+        model: Optional[str] = None
+    ) -> GroqResponse:
+        """Async variant of generate_study_materials."""
+        if not self.aclient:
+            return self._not_configured()
         
-        system_prompt = """You are an expert educator creating comprehensive study materials.
-
-Generate well-structured study notes in Markdown format including:
-- Key concepts with clear explanations
-- Important definitions
-- Examples where applicable
-- Common pitfalls or misconceptions
-- Summary section
-
-Format with proper Markdown headers, bullet points, and code blocks where appropriate."""
-
-        user_message = f"""Create comprehensive study materials from this content:
-
-{context}"""
-
         try:
-            response = self.client.chat.completions.create(
+            response = await self._acreate_with_retry(
                 model=model or self.DEFAULT_MODEL,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_message}
-                ],
+                messages=self._study_messages(context),
                 temperature=0.7,
                 max_tokens=4096
             )
             
-            return GroqResponse(
-                content=response.choices[0].message.content,
-                model=response.model,
-                usage={
-                    "prompt_tokens": response.usage.prompt_tokens,
-                    "completion_tokens": response.usage.completion_tokens,
-                    "total_tokens": response.usage.total_tokens
-                },
-                success=True
-            )
+            return self._to_response(response)
             
         except Exception as e:
             return GroqResponse(
@@ -380,6 +562,126 @@ Format with proper Markdown headers, bullet points, and code blocks where approp
                 success=False,
                 error=str(e)
             )
+    
+    def astream_study_materials(
+        self,
+        context: str,
+        model: Optional[str] = None
+    ) -> AsyncIterator[Union[str, GroqResponse]]:
+        """
+        Stream study materials as Groq generates them.
+        
+        Args:
+            context: The content to generate materials from
+            model: Optional model override
+            
+        Yields:
+            Content deltas as str, then a final GroqResponse with the
+            full content and token usage
+        """
+        return self._astream(
+            messages=self._study_messages(context),
+            model=model,
+            temperature=0.7,
+            max_tokens=4096
+        )
+    
+    def astream_query(
+        self,
+        user_query: str,
+        retrieved_context: str,
+        model: Optional[str] = None,
+        system_prompt: Optional[str] = None
+    ) -> AsyncIterator[Union[str, GroqResponse]]:
+        """
+        Streaming variant of query_groq (bypasses the semantic cache).
+        
+        Yields:
+            Content deltas as str, then a final GroqResponse with the
+            full content and token usage
+        """
+        return self._astream(
+            messages=self._query_messages(user_query, retrieved_context, system_prompt),
+            model=model,
+            temperature=0.7,
+            max_tokens=1024
+        )
+    
+    async def _astream(
+        self,
+        messages: list[dict],
+        model: Optional[str],
+        temperature: float,
+        max_tokens: int
+    ) -> AsyncIterator[Union[str, GroqResponse]]:
+        """Run a streaming chat completion, yielding deltas then a final GroqResponse."""
+        if not self.aclient:
+            yield self._not_configured()
+            return
+        
+        parts = []
+        response_model = ""
+        usage = {}
+        stream = None
+        
+        try:
+            stream = await self._acreate_with_retry(
+                model=model or self.DEFAULT_MODEL,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True
+            )
+            
+            async for chunk in stream:
+                response_model = chunk.model or response_model
+                
+                # Groq reports usage on the last chunk
+                x_groq = getattr(chunk, "x_groq", None)
+                if x_groq and getattr(x_groq, "usage", None):
+                    usage = {
+                        "prompt_tokens": x_groq.usage.prompt_tokens,
+                        "completion_tokens": x_groq.usage.completion_tokens,
+                        "total_tokens": x_groq.usage.total_tokens
+                    }
+                
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield delta
+            
+            yield GroqResponse(
+                content="".join(parts),
+                model=response_model,
+                usage=usage,
+                success=True
+            )
+            
+        except Exception as e:
+            yield GroqResponse(
+                content="".join(parts),
+                model=response_model,
+                usage=usage,
+                success=False,
+                error=str(e)
+            )
+        finally:
+            # Closing the HTTP response stops generation upstream if the
+            # consumer went away early
+            if stream is not None:
+                await stream.close()
+    
+    @staticmethod
+    def _study_messages(context: str) -> list[dict]:
+        """Build the chat messages for study material generation."""
+        user_message = f"""Create comprehensive study materials from this content:
+
+{context}"""
+
+        return [
+            {"role": "system", "content": _STUDY_SYSTEM_PROMPT},
+            {"role": "user", "content": user_message}
+        ]
 
 
 # Global Groq service instance
@@ -6,14 +6,44 @@ before embedding to ChromaDB for efficient context management.
 """
 
 import asyncio
+import logging
 import time
 import uuid
 from dataclasses import dataclass, field
 from typing import Optional
 from datetime import datetime
-import threading
+
+import numpy as np
 
 from db import collection
+from embeddings import get_embedding_store
+from query_cache import get_query_cache
+from study_models import record_session_chunk
+from vision import analyze_image_batch
+
+logger = logging.getLogger(__name__)
+
+# Section headers for the combined chunk text
+VISUAL_HEADER = "Visual Context:\n"
+AUDIO_HEADER = "Audio Transcript:\n"
+
+# Closed chunks are written to ChromaDB in groups: every FLUSH_EVERY_TICKS
+# batch windows or once MAX_PENDING_CHUNKS are queued, whichever comes first.
+FLUSH_EVERY_TICKS = 4
+MAX_PENDING_CHUNKS = 8
+
+# A group whose write fails goes back on the queue for the next tick; a chunk
+# that has failed this many writes is dropped so the queue stays bounded
+MAX_WRITE_ATTEMPTS = 3
+
+# Chunks this similar to the previous chunk of the session are not stored
+# (static screen, repeated OCR); the previous chunk's duplicate_count is bumped instead
+DUPLICATE_SIMILARITY = 0.98
+
+# Frames submitted to /analyze are described in groups of up to VISION_MAX_BATCH,
+# waiting at most VISION_BATCH_WAIT_SEC for a group to fill
+VISION_MAX_BATCH = 8
+VISION_BATCH_WAIT_SEC = 0.05
 
 
 @dataclass
@@ -24,18 +54,18 @@ class ContextChunk:
     transcripts: list[str] = field(default_factory=list)
     frame_descriptions: list[str] = field(default_factory=list)
     session_id: str = ""
+    write_attempts: int = 0
     
     def get_combined_text(self) -> str:
         """Combine all content into a single text for embedding."""
         parts = []
         
         if self.frame_descriptions:
-            parts.append("Visual Context:")
-            parts.append(" ".join(self.frame_descriptions))
+            # Identical descriptions of a static screen add nothing; keep first occurrences
+            parts.append(VISUAL_HEADER + " ".join(dict.fromkeys(self.frame_descriptions)))
         
         if self.transcripts:
-            parts.append("Audio Transcript:")
-            parts.append(" ".join(self.transcripts))
+            parts.append(AUDIO_HEADER + " ".join(self.transcripts))
         
         return "\n".join(parts)
     
@@ -56,7 +86,12 @@ class IngestionBuffer:
         self.batch_duration_sec = batch_duration_sec
         self.current_chunk: Optional[ContextChunk] = None
         self.session_id = str(uuid.uuid4())
-        self._lock = threading.Lock()
+        self._lock = asyncio.Lock()
+        self._pending: list[ContextChunk] = []
+        self._ticks_since_flush = 0
+        # Most recently kept chunk and its embedding, for near-duplicate skipping
+        self._last_item: Optional[dict] = None
+        self._last_embedding: Optional[np.ndarray] = None
         self._batch_task: Optional[asyncio.Task] = None
         self._is_running = False
         
@@ -75,69 +110,181 @@ class IngestionBuffer:
             self._batch_task.cancel()
             
     def _start_new_chunk(self):
-        """Initialize a new 10-second chunk."""
+        """Initialize a new 10-second chunk (callers hold the lock once running)."""
         current_time = time.time()
-        with self._lock:
-            self.current_chunk = ContextChunk(
-                start_time=current_time,
-                end_time=current_time + self.batch_duration_sec,
-                session_id=self.session_id
-            )
-    
-    def add_transcript(self, text: str, timestamp: Optional[float] = None):
+        self.current_chunk = ContextChunk(
+            start_time=current_time,
+            end_time=current_time + self.batch_duration_sec,
+            session_id=self.session_id
+        )
+    
+    async def add_transcript(self, text: str, timestamp: Optional[float] = None):
         """Add a transcript segment to the current batch."""
-        if not self.current_chunk:
-            self._start_new_chunk()
-            
-        with self._lock:
+        async with self._lock:
+            if not self.current_chunk:
+                self._start_new_chunk()
             self.current_chunk.transcripts.append(text)
     
-    def add_frame_description(self, description: str, timestamp: Optional[float] = None):
+    async def add_frame_description(self, description: str, timestamp: Optional[float] = None):
         """Add a frame description to the current batch."""
-        if not self.current_chunk:
-            self._start_new_chunk()
-            
-        with self._lock:
+        async with self._lock:
+            if not self.current_chunk:
+                self._start_new_chunk()
             self.current_chunk.frame_descriptions.append(description)
     
-    async def process_current_batch(self):
-        """Process the current batch and embed to ChromaDB."""
-        with self._lock:
-            if not self.current_chunk:
+    async def process_current_batch(self, force: bool = False):
+        """
+        Close the current batch and embed pending chunks to ChromaDB when due.
+        
+        Args:
+            force: Write all pending chunks now instead of waiting for the flush threshold
+        """
+        async with self._lock:
+            if not self.current_chunk and not force:
                 return
             
             chunk = self.current_chunk
             self._start_new_chunk()
+            
+            # Skip empty batches
+            if chunk and (chunk.transcripts or chunk.frame_descriptions):
+                self._pending.append(chunk)
+            
+            if not self._pending:
+                self._ticks_since_flush = 0
+                return
+            
+            self._ticks_since_flush += 1
+            if (not force
+                    and self._ticks_since_flush < FLUSH_EVERY_TICKS
+                    and len(self._pending) < MAX_PENDING_CHUNKS):
+                return
+            
+            pending = self._pending
+            self._pending = []
+            self._ticks_since_flush = 0
+        
+        await self._write_chunks(pending)
+    
+    async def _write_chunks(self, chunks: list[ContextChunk]):
+        """Embed a group of chunks and store them with a single ChromaDB write."""
+        items = []
+        sessions = {}
+        for chunk in chunks:
+            # Generate metadata for the chunk
+            metadata = {
+                "start_time_ms": int(chunk.start_time * 1000),
+                "end_time_ms": int(chunk.end_time * 1000),
+                "session_id": chunk.session_id,
+                "content_type": "mixed",
+                "transcript_count": len(chunk.transcripts),
+                "frame_count": len(chunk.frame_descriptions),
+                "duration_sec": chunk.get_duration()
+            }
+            
+            # Store in ChromaDB with unique ID
+            items.append({
+                "id": f"chunk_{chunk.start_time}",
+                "text": chunk.get_combined_text(),
+                "metadata": metadata
+            })
+            
+            first, last = sessions.get(chunk.session_id, (chunk.start_time, chunk.end_time))
+            sessions[chunk.session_id] = (min(first, chunk.start_time), max(last, chunk.end_time))
         
-        # Skip empty batches
-        if not chunk.transcripts and not chunk.frame_descriptions:
+        store = get_embedding_store()
+        try:
+            embeddings = await store.aencode([item["text"] for item in items])
+            kept, kept_embeddings, updated, last_item, last_embedding = self._drop_duplicates(items, embeddings)
+            
+            if kept:
+                await asyncio.to_thread(store.upsert_embeddings, collection, kept, np.stack(kept_embeddings))
+            if updated:
+                await asyncio.to_thread(
+                    collection.update,
+                    ids=[item["id"] for item in updated],
+                    metadatas=[item["metadata"] for item in updated]
+                )
+        except Exception:
+            logger.exception("[Ingestion] Failed to embed %d chunks", len(items))
+            await self._requeue(chunks)
             return
         
-        combined_text = chunk.get_combined_text()
+        # Only compare future chunks against what was actually stored
+        self._last_item, self._last_embedding = last_item, last_embedding
         
-        # Generate metadata for the chunk
-        metadata = {
-            "start_time": datetime.fromtimestamp(chunk.start_time).isoformat(),
-            "end_time": datetime.fromtimestamp(chunk.end_time).isoformat(),
-            "session_id": chunk.session_id,
-            "content_type": "mixed",
-            "transcript_count": len(chunk.transcripts),
-            "frame_count": len(chunk.frame_descriptions),
-            "duration_sec": chunk.get_duration()
-        }
+        total_chars = sum(len(item["text"]) for item in kept)
+        skipped = len(items) - len(kept)
+        print(f"[Ingestion] Embedded {len(kept)} chunks ({total_chars} chars), skipped {skipped} duplicates")
         
-        # Store in ChromaDB with unique ID
-        chunk_id = f"chunk_{chunk.start_time}"
+        for session_id, (first, last) in sessions.items():
+            get_query_cache().invalidate(session_id)
+            try:
+                await asyncio.to_thread(
+                    record_session_chunk,
+                    session_id,
+                    datetime.fromtimestamp(first),
+                    datetime.fromtimestamp(last),
+                    chunks=sum(1 for item in kept if item["metadata"]["session_id"] == session_id)
+                )
+            except Exception:
+                logger.exception("[Ingestion] Failed to record session %s", session_id)
+    
+    async def _requeue(self, chunks: list[ContextChunk]):
+        """Put a failed group back at the front of the queue so the next tick retries it."""
+        retry = []
+        for chunk in chunks:
+            chunk.write_attempts += 1
+            if chunk.write_attempts < MAX_WRITE_ATTEMPTS:
+                retry.append(chunk)
         
-        try:
-            collection.add(
-                documents=[combined_text],
-                ids=[chunk_id],
-                metadatas=[metadata]
-            )
-            print(f"[Ingestion] Embedded chunk: {chunk_id} ({len(combined_text)} chars)")
-        except Exception as e:
-            print(f"[Ingestion] Failed to embed chunk: {e}")
+        dropped = len(chunks) - len(retry)
+        if dropped:
+            logger.error("[Ingestion] Dropping %d chunks after %d failed writes", dropped, MAX_WRITE_ATTEMPTS)
+        if not retry:
+            return
+        
+        async with self._lock:
+            self._pending[:0] = retry
+            # The next process_current_batch call reaches the flush threshold
+            self._ticks_since_flush = FLUSH_EVERY_TICKS - 1
+    
+    def _drop_duplicates(self, items: list[dict], embeddings: np.ndarray):
+        """
+        Drop chunks nearly identical to the previous kept chunk of the same session.
+        
+        Works on copies so nothing is committed to self until the caller's
+        write succeeds.
+        
+        Returns:
+            Tuple of (kept items, their embeddings, already-written items whose
+            duplicate_count changed and need a metadata update, new last item,
+            its embedding)
+        """
+        kept, kept_embeddings, updated = [], [], []
+        last_item, last_embedding = self._last_item, self._last_embedding
+        
+        for item, embedding in zip(items, embeddings):
+            if (last_item is not None
+                    and last_item["metadata"]["session_id"] == item["metadata"]["session_id"]
+                    and float(np.dot(embedding, last_embedding)) > DUPLICATE_SIMILARITY):
+                # Vectors are unit-norm, so the dot product is the cosine similarity
+                if not any(last_item is k for k in kept) and not any(last_item is u for u in updated):
+                    # Already stored: extend a copy, sent as a metadata update
+                    last_item = {**last_item, "metadata": dict(last_item["metadata"])}
+                    updated.append(last_item)
+                
+                metadata = last_item["metadata"]
+                metadata["duplicate_count"] = metadata.get("duplicate_count", 0) + 1
+                metadata["end_time_ms"] = item["metadata"]["end_time_ms"]
+                metadata["duration_sec"] = (metadata["end_time_ms"] - metadata["start_time_ms"]) / 1000
+                continue
+            
+            kept.append(item)
+            kept_embeddings.append(embedding)
+            last_item, last_embedding = item, embedding
+        
+        return kept, kept_embeddings, updated, last_item, last_embedding
     
     async def run_batch_loop(self):
         """Background task that processes batches every 10 seconds."""
@@ -146,9 +293,76 @@ class IngestionBuffer:
             await self.process_current_batch()
 
 
+class VisionBatcher:
+    """
+    Queue of frames waiting for the vision model.
+    
+    A single worker drains up to VISION_MAX_BATCH frames at a time and runs
+    them through analyze_image_batch in the executor, so the (non thread-safe)
+    llama.cpp model is never entered from two threads at once.
+    """
+    
+    def __init__(self, max_batch: int = VISION_MAX_BATCH, max_wait_sec: float = VISION_BATCH_WAIT_SEC):
+        self.max_batch = max_batch
+        self.max_wait_sec = max_wait_sec
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+    
+    async def submit(self, image_bytes: bytes | memoryview, prompt: str) -> str:
+        """Queue a frame and wait for its description."""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((image_bytes, prompt, future))
+        return await future
+    
+    def stop(self):
+        """Cancel the worker task."""
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
+    
+    async def _run(self):
+        """Collect frames for up to max_wait_sec, then describe them as one batch."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait_sec
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            try:
+                texts = await loop.run_in_executor(
+                    None,
+                    analyze_image_batch,
+                    [item[0] for item in batch],
+                    [item[1] for item in batch]
+                )
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for (_, _, future), text in zip(batch, texts):
+                if not future.done():
+                    future.set_result(text)
+
+
 # Global ingestion buffer instance
 ingestion_buffer = IngestionBuffer(batch_duration_sec=10.0)
 
+# Global vision batcher instance
+vision_batcher = VisionBatcher()
+
 
 async def start_ingestion_service():
     """Start the ingestion background service."""
@@ -162,17 +376,18 @@ async def start_ingestion_service():
 async def stop_ingestion_service():
     """Stop the ingestion background service."""
     # Process any remaining content
-    await ingestion_buffer.process_current_batch()
+    await ingestion_buffer.process_current_batch(force=True)
     ingestion_buffer.stop()
+    vision_batcher.stop()
     print("[Ingestion] Service stopped")
 
 
-def add_to_buffer(transcript: Optional[str] = None, frame_description: Optional[str] = None):
+async def add_to_buffer(transcript: Optional[str] = None, frame_description: Optional[str] = None):
     """
     Convenience function to add content to the ingestion buffer.
-    Can be called from synchronous code (e.g., WebSocket handlers).
+    Called from the event loop (e.g., WebSocket handlers, /analyze).
     """
     if transcript:
-        ingestion_buffer.add_transcript(transcript)
+        await ingestion_buffer.add_transcript(transcript)
     if frame_description:
-        ingestion_buffer.add_frame_description(frame_description)
+        await ingestion_buffer.add_frame_description(frame_description)
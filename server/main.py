@@ -1,94 +1,160 @@
 from fastapi import FastAPI, WebSocket, UploadFile, File, HTTPException, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 from typing import Optional, List
-from db import collection, query_by_session, get_session_ids
+from db import (
+    collection,
+    query_batcher,
+    query_by_session,
+    get_session_ids,
+    migrate_session_index,
+    save_hot_queries,
+    warm_index
+)
 from ws_manager import handle_audio_stream
-from vision import load_model, analyze_image
+from models import warm_up_whisper_model
+from vision import load_model
 from ingestion_buffer import (
     start_ingestion_service,
     stop_ingestion_service,
     add_to_buffer,
-    ingestion_buffer
+    ingestion_buffer,
+    vision_batcher
 )
-from groq_service import get_groq_service, GroqService
+from groq_service import get_groq_service, GroqService, GroqResponse
+from embeddings import get_embedding_store, format_sources, chunk_time_bounds_ms, with_iso_times
+from groq_cache import SemanticGroqCache
+from query_cache import get_query_cache
 from study_models import (
     init_db,
     get_db,
     get_session_stats,
     get_all_sessions_stats,
+    utc_now,
     StudySession,
     Flashcard,
-    UserPerformance,
-    SessionLocal
+    UserPerformance
 )
 from sqlalchemy.orm import Session
+import os
 import asyncio
 import time
+import traceback
+from contextlib import asynccontextmanager, aclosing
 import uuid
-import json
-import re
+import orjson
+from datetime import datetime, timezone
+from zlib import crc32
 
 # Rate limiting
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 
-# Initialize rate limiter
-limiter = Limiter(key_func=get_remote_address)
+# Replay the previous run's hot queries at startup (VECTOR_CACHE_WARMUP=false to skip)
+VECTOR_CACHE_WARMUP = os.getenv("VECTOR_CACHE_WARMUP", "true").lower() == "true"
 
-app = FastAPI(title="Real-Time Context Streaming API")
+# Rate limit buckets (requests per client per minute)
+RATE_LIMIT_GENERATE = "5/minute"    # LLM generation and manual flush
+RATE_LIMIT_INQUIRE = "10/minute"    # RAG inquiry
+RATE_LIMIT_READ = "20/minute"       # Listings, stats and single adds
+RATE_LIMIT_FAST = "30/minute"       # Vector query, review and frame analysis
 
-# Add rate limiter to app state
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
-# CORS Configuration
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        "http://localhost:3000",
-        "http://127.0.0.1:3000",
-        "http://localhost:5173",
-        "http://localhost:3001",  # TanStack Start
-    ],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def _client_key(request: Request) -> str:
+    """Rate limit key: CRC32 of the client address, so every counter key has the
+    same short width (IPv6 included); collisions only merge two clients' quotas."""
+    return format(crc32(get_remote_address(request).encode()), "08x")
+
+
+# Initialize rate limiter
+limiter = Limiter(key_func=_client_key)
 
-# Initialize database on startup
-@app.on_event("startup")
-async def startup_event():
+async def _load_vision_model(state):
+    """Load the vision model off the event loop, then mark it ready."""
     try:
-        import traceback
         print("🚀 Starting vision model load...", flush=True)
-        load_model()
+        await asyncio.to_thread(load_model)
+        state.model_loaded = True
         print("✅ Vision model + Adapter loaded successfully", flush=True)
     except Exception as e:
         print(f"❌ Vision model failed: {e}", flush=True)
         print(f"📋 Full Traceback:", flush=True)
         print(traceback.format_exc(), flush=True)
+    finally:
+        # Set even on failure so waiting requests fail fast instead of hanging
+        state.model_ready.set()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Vision model loads in the background; the server accepts requests meanwhile
+    app.state.model_loaded = False
+    app.state.model_ready = asyncio.Event()
+    model_task = asyncio.create_task(_load_vision_model(app.state))
+    
+    # Speech model too, so the first websocket window pays for neither the
+    # load nor the first-decode setup
+    stt_task = asyncio.create_task(asyncio.to_thread(warm_up_whisper_model))
+    
+    # Held for the app's lifetime so the task isn't garbage-collected mid-run
+    warmup_task = asyncio.create_task(asyncio.to_thread(warm_index)) if VECTOR_CACHE_WARMUP else None
     
     # Initialize SQLite database
     try:
         init_db()
+        migrate_session_index()
         print("✅ SQLite database initialized", flush=True)
     except Exception as e:
         print(f"❌ Database initialization failed: {e}", flush=True)
     
+    # Attach semantic cache for repeated RAG questions
+    try:
+        get_groq_service().cache = SemanticGroqCache()
+        print("✅ Groq semantic cache ready", flush=True)
+    except Exception as e:
+        print(f"❌ Groq semantic cache failed: {e}", flush=True)
+    
     # Start ingestion service
     try:
         await start_ingestion_service()
         print("✅ Ingestion service started", flush=True)
     except Exception as e:
         print(f"❌ Ingestion service failed: {e}", flush=True)
+    
+    yield
+    
+    await stop_ingestion_service()
+    query_batcher.stop()
+    
+    # Settle the background start-up tasks so none is destroyed while pending
+    startup_tasks = [task for task in (model_task, stt_task, warmup_task) if task is not None]
+    for task in startup_tasks:
+        task.cancel()
+    await asyncio.gather(*startup_tasks, return_exceptions=True)
+    save_hot_queries()
 
 
-@app.on_event("shutdown")
-async def shutdown_event():
-    await stop_ingestion_service()
+app = FastAPI(title="Real-Time Context Streaming API", lifespan=lifespan)
 
+# Add rate limiter to app state
+app.state.limiter = limiter
+app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+
+# CORS Configuration
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=[
+        "http://localhost:3000",
+        "http://127.0.0.1:3000",
+        "http://localhost:5173",
+        "http://localhost:3001",  # TanStack Start
+    ],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
 
 # ============ Request/Response Models ============
 
@@ -133,27 +199,95 @@ class StudyMaterialRequest(BaseModel):
     time_range: Optional[dict] = Field(None, description="Time range {start, end}")
 
 
+class QueryResponse(BaseModel):
+    ids: List[List[str]]
+    documents: Optional[List[List[Optional[str]]]] = None
+    metadatas: Optional[List[List[Optional[dict]]]] = None
+    distances: Optional[List[List[float]]] = None
+    embeddings: Optional[List[List[List[float]]]] = None
+
+
+class EmbeddingItem(BaseModel):
+    id: str
+    text: Optional[str] = ""
+    metadata: Optional[dict] = None
+    embedding: List[float] = []
+
+
+class EmbeddingsResponse(BaseModel):
+    chunks: List[EmbeddingItem]
+
+
 # ============ Vector DB Endpoints ============
 
 @app.post("/add")
-@limiter.limit("20/minute")
-def add_item(request: Request, item: Item):
+@limiter.limit(RATE_LIMIT_READ)
+async def add_item(request: Request, item: Item):
     """Add a single item to the vector store."""
-    collection.add(documents=[item.text], ids=[item.id])
+    await asyncio.to_thread(collection.add, documents=[item.text], ids=[item.id])
+    get_query_cache().invalidate_all()
     return {"status": "added"}
 
 
-@app.post("/query")
-@limiter.limit("30/minute")
-def query_items(request: Request, text: str, n: int = 5):
+@app.post("/query", response_model=QueryResponse)
+@limiter.limit(RATE_LIMIT_FAST)
+async def query_items(request: Request, text: str, n: int = 5):
     """Query the vector store for similar items."""
-    return collection.query(query_texts=[text], n_results=n)
+    cache = get_query_cache()
+    key = ("query", text, None, n)
+    results = cache.get(key)
+    if results is None:
+        embedding = await get_embedding_store().aembed_query(text)
+        results = await query_batcher.submit(embedding.tolist(), n)
+        if results.get("metadatas"):
+            results["metadatas"] = [[with_iso_times(m) for m in row] for row in results["metadatas"]]
+        cache.put(key, results)
+    return results
+
+
+@app.get("/api/v1/embeddings", response_model=EmbeddingsResponse)
+@limiter.limit(RATE_LIMIT_READ)
+async def get_embeddings(
+    request: Request,
+    session_id: Optional[str] = Query(None),
+    limit: int = Query(50),
+    include_embeddings: bool = Query(False)
+):
+    """List stored context chunks, newest first."""
+    try:
+        chunks = await asyncio.to_thread(
+            get_embedding_store().get_embeddings,
+            collection,
+            session_id=session_id,
+            limit=limit,
+            include_embeddings=include_embeddings
+        )
+        return {"chunks": chunks}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 
 # ============ Groq-Powered Inquiry Endpoint ============
 
+async def _retrieve_context(inquiry_req: InquiryRequest) -> dict:
+    """Search for an inquiry's context chunks, through the query result cache."""
+    cache = get_query_cache()
+    cache_key = ("inquire", inquiry_req.query, inquiry_req.session_id, inquiry_req.n_results)
+    results = cache.get(cache_key)
+    if results is None:
+        # Search within a specific session, or globally
+        results = await get_embedding_store().asearch_embeddings(
+            query_batcher,
+            inquiry_req.query,
+            limit=inquiry_req.n_results,
+            where={"session_id": inquiry_req.session_id} if inquiry_req.session_id else None
+        )
+        cache.put(cache_key, results)
+    return results
+
+
 @app.post("/api/v1/inquire", response_model=InquiryResponse)
-@limiter.limit("10/minute")
+@limiter.limit(RATE_LIMIT_INQUIRE)
 async def inquire(request: Request, inquiry_req: InquiryRequest):
     """
     Ask a question about your screen content.
@@ -162,60 +296,43 @@ async def inquire(request: Request, inquiry_req: InquiryRequest):
     """
     groq = get_groq_service()
     
-    # Retrieve relevant context from ChromaDB
+    # Warm the Groq connection while retrieval runs, so the completion
+    # below doesn't pay connection setup after the search
+    warmup = asyncio.create_task(groq.aensure_session()) if groq.is_available else None
+    
     try:
-        if inquiry_req.session_id:
-            # Search within specific session
-            results = collection.query(
-                query_texts=[inquiry_req.query],
-                n_results=inquiry_req.n_results,
-                where={"session_id": inquiry_req.session_id}
+        # Retrieve relevant context from ChromaDB
+        try:
+            results = await _retrieve_context(inquiry_req)
+        except Exception as e:
+            return InquiryResponse(
+                answer=f"Failed to retrieve context: {str(e)}",
+                sources=[],
+                used_groq=False,
+                error=str(e)
             )
-        else:
-            # Global search
-            results = collection.query(
-                query_texts=[inquiry_req.query],
-                n_results=inquiry_req.n_results
+        
+        # Format retrieved context
+        sources, combined_context = format_sources(results)
+        
+        if not combined_context.strip():
+            return InquiryResponse(
+                answer="No relevant context found in your screen history. Try asking about something you recently viewed or discussed.",
+                sources=[],
+                used_groq=False
             )
-    except Exception as e:
-        return InquiryResponse(
-            answer=f"Failed to retrieve context: {str(e)}",
-            sources=[],
-            used_groq=False,
-            error=str(e)
-        )
-    
-    # Format retrieved context
-    sources = []
-    context_parts = []
-    
-    documents = results.get("documents", [[]])[0]
-    metadatas = results.get("metadatas", [[]])[0]
-    distances = results.get("distances", [[]])[0] if "distances" in results else [0] * len(documents)
-    
-    for i, (doc, meta, dist) in enumerate(zip(documents, metadatas, distances)):
-        context_parts.append(f"[Context {i+1}]:\n{doc}")
-        sources.append({
-            "id": i,
-            "start_time": meta.get("start_time", "") if meta else "",
-            "end_time": meta.get("end_time", "") if meta else "",
-            "session_id": meta.get("session_id", "") if meta else "",
-            "relevance_score": 1 - dist if dist else 1.0
-        })
-    
-    combined_context = "\n\n".join(context_parts)
-    
-    if not combined_context.strip():
-        return InquiryResponse(
-            answer="No relevant context found in your screen history. Try asking about something you recently viewed or discussed.",
-            sources=[],
-            used_groq=False
-        )
+        
+        if warmup:
+            await warmup
+    finally:
+        # No-op once awaited; stops the warm-up on the early returns above
+        if warmup:
+            warmup.cancel()
     
     # Try Groq for intelligent response
     if groq.is_available:
         try:
-            groq_response = groq.query_groq(
+            groq_response = await groq.aquery_groq(
                 user_query=inquiry_req.query,
                 retrieved_context=combined_context
             )
@@ -241,30 +358,149 @@ async def inquire(request: Request, inquiry_req: InquiryRequest):
     )
 
 
+@app.post("/api/v1/inquire/stream")
+@limiter.limit(RATE_LIMIT_INQUIRE)
+async def inquire_stream(request: Request, inquiry_req: InquiryRequest):
+    """
+    Stream an inquiry answer as Server-Sent Events.
+    Emits a {"sources": [...]} event, then {"delta": ...} events as tokens
+    arrive, then a final {"done": true, ...} event.
+    """
+    groq = get_groq_service()
+    if not groq.is_available:
+        raise HTTPException(status_code=503, detail="Groq API not configured")
+    
+    warmup = asyncio.create_task(groq.aensure_session())
+    try:
+        try:
+            results = await _retrieve_context(inquiry_req)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to retrieve context: {e}")
+        
+        sources, combined_context = format_sources(results)
+        if not combined_context.strip():
+            raise HTTPException(status_code=404, detail="No relevant context found")
+    except BaseException:
+        # No stream will await the warm-up on these paths
+        warmup.cancel()
+        raise
+    
+    async def event_stream():
+        yield b"data: " + orjson.dumps({"sources": sources}) + b"\n\n"
+        await warmup
+        
+        stream = groq.astream_query(
+            user_query=inquiry_req.query,
+            retrieved_context=combined_context
+        )
+        # aclosing() closes the upstream Groq stream as soon as we stop reading
+        async with aclosing(stream):
+            async for item in stream:
+                if isinstance(item, GroqResponse):
+                    event = {
+                        "done": True,
+                        "success": item.success,
+                        "model": item.model,
+                        "usage": item.usage,
+                        "error": item.error
+                    }
+                else:
+                    if await request.is_disconnected():
+                        print("[Inquire] Client disconnected, aborting stream")
+                        return
+                    event = {"delta": item}
+                yield b"data: " + orjson.dumps(event) + b"\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 # ============ Flashcard Generation Endpoints ============
 
+# Fixed query used to pick study-worthy chunks when no session is given
+STUDY_CONTEXT_QUERY = "study material, concepts, key points"
+
+
+async def _study_chunks(session_id: Optional[str]) -> tuple[list, list]:
+    """Retrieve (documents, metadatas) to generate study content from."""
+    if session_id:
+        # collection.get returns flat lists
+        results = await asyncio.to_thread(query_by_session, session_id, n_results=50)
+        return results.get("documents") or [], results.get("metadatas") or []
+    
+    embedding = await get_embedding_store().aembed_query(STUDY_CONTEXT_QUERY)
+    results = await query_batcher.submit(embedding.tolist(), 50)
+    return results["documents"][0], results["metadatas"][0]
+
+
+def _save_flashcards(
+    db: Session,
+    session_id: str,
+    flashcards_list: list[dict],
+    documents: list,
+    metadatas: list
+) -> list[dict]:
+    """Persist generated flashcards, creating the study session if needed."""
+    try:
+        session = db.query(StudySession).filter(StudySession.id == session_id).first()
+        if not session:
+            # StudySession stores naive UTC datetimes
+            if metadatas and metadatas[0]:
+                start_ms = chunk_time_bounds_ms(metadatas[0])[0]
+                start_time = datetime.fromtimestamp(start_ms / 1000, timezone.utc).replace(tzinfo=None)
+            else:
+                start_time = utc_now()
+            session = StudySession(
+                id=session_id,
+                start_time=start_time,
+                total_chunks=len(documents)
+            )
+            db.add(session)
+        
+        # Save flashcards to database
+        created_flashcards = []
+        for fc in flashcards_list:
+            flashcard = Flashcard(
+                id=str(uuid.uuid4()),
+                session_id=session_id,
+                question=fc.get("question", ""),
+                answer=fc.get("answer", ""),
+                difficulty=fc.get("difficulty", "medium"),
+                topic=fc.get("topic", "")
+            )
+            db.add(flashcard)
+            created_flashcards.append({
+                "id": flashcard.id,
+                "question": flashcard.question,
+                "answer": flashcard.answer,
+                "difficulty": flashcard.difficulty,
+                "topic": flashcard.topic
+            })
+        
+        session.total_flashcards = len(created_flashcards)
+        db.commit()
+        get_all_sessions_stats.cache_clear()
+        return created_flashcards
+    except Exception:
+        db.rollback()
+        raise
+
+
 @app.post("/api/v1/generate/flashcards", response_model=FlashcardResponse)
-@limiter.limit("5/minute")
-async def generate_flashcards(request: Request, flashcard_req: FlashcardGenerateRequest):
+@limiter.limit(RATE_LIMIT_GENERATE)
+async def generate_flashcards(
+    request: Request,
+    flashcard_req: FlashcardGenerateRequest,
+    db: Session = Depends(get_db)
+):
     """
     Generate flashcards from screen content.
     Uses Groq to create high-quality Q&A pairs from your context.
     """
     groq = get_groq_service()
-    db = SessionLocal()
     
     try:
         # Retrieve context
-        if flashcard_req.session_id:
-            results = query_by_session(flashcard_req.session_id, n_results=50)
-        else:
-            results = collection.query(
-                query_texts=["study material, concepts, key points"],
-                n_results=50
-            )
-        
-        documents = results.get("documents", [[]])[0]
-        metadatas = results.get("metadatas", [[]])[0]
+        documents, metadatas = await _study_chunks(flashcard_req.session_id)
         
         if not documents:
             return FlashcardResponse(
@@ -284,7 +520,7 @@ async def generate_flashcards(request: Request, flashcard_req: FlashcardGenerate
                 error="Groq API not configured. Please add GROQ_API_KEY to your environment."
             )
         
-        groq_response = groq.generate_flashcards(
+        groq_response = await groq.agenerate_flashcards(
             context=combined_context,
             count=flashcard_req.count
         )
@@ -296,55 +532,20 @@ async def generate_flashcards(request: Request, flashcard_req: FlashcardGenerate
                 error=f"Groq API error: {groq_response.error}"
             )
         
-        # Parse JSON response
-        try:
-            # Extract JSON from response
-            json_match = re.search(r'\{[\s\S]*\}', groq_response.content)
-            if json_match:
-                flashcards_data = json.loads(json_match.group(0))
-                flashcards_list = flashcards_data.get("flashcards", [])
-            else:
-                flashcards_list = []
-        except json.JSONDecodeError as e:
+        # Response JSON is parsed once in the Groq service
+        if groq_response.data is None:
             return FlashcardResponse(
                 flashcards=[],
                 success=False,
-                error=f"Failed to parse flashcards: {str(e)}"
+                error="Failed to parse flashcards: response was not valid JSON"
             )
+        flashcards_list = groq_response.data.get("flashcards", [])
         
-        # Create session if needed
+        # Create session if needed and save flashcards
         session_id = flashcard_req.session_id or str(uuid.uuid4())
-        session = db.query(StudySession).filter(StudySession.id == session_id).first()
-        if not session:
-            session = StudySession(
-                id=session_id,
-                start_time=results["metadatas"][0][0].get("start_time") if results["metadatas"] and results["metadatas"][0] else None,
-                total_chunks=len(documents)
-            )
-            db.add(session)
-        
-        # Save flashcards to database
-        created_flashcards = []
-        for fc in flashcards_list:
-            flashcard = Flashcard(
-                id=str(uuid.uuid4()),
-                session_id=session_id,
-                question=fc.get("question", ""),
-                answer=fc.get("answer", ""),
-                difficulty=fc.get("difficulty", "medium"),
-                topic=fc.get("topic", "")
-            )
-            db.add(flashcard)
-            created_flashcards.append({
-                "id": flashcard.id,
-                "question": flashcard.question,
-                "answer": flashcard.answer,
-                "difficulty": flashcard.difficulty,
-                "topic": flashcard.topic
-            })
-        
-        session.total_flashcards = len(created_flashcards)
-        db.commit()
+        created_flashcards = await asyncio.to_thread(
+            _save_flashcards, db, session_id, flashcards_list, documents, metadatas
+        )
         
         return FlashcardResponse(
             flashcards=created_flashcards,
@@ -352,28 +553,23 @@ async def generate_flashcards(request: Request, flashcard_req: FlashcardGenerate
         )
         
     except Exception as e:
-        db.rollback()
         return FlashcardResponse(
             flashcards=[],
             success=False,
             error=str(e)
         )
-    finally:
-        db.close()
 
 
-@app.post("/api/v1/flashcard/review")
-@limiter.limit("30/minute")
-async def review_flashcard(request: Request, update_req: FlashcardUpdateRequest):
-    """Update flashcard statistics after a review."""
-    db = SessionLocal()
+def _review_flashcard(db: Session, flashcard_id: str, was_correct: bool) -> Optional[dict]:
+    """Apply a review to a flashcard; returns None if it does not exist."""
     try:
-        flashcard = db.query(Flashcard).filter(Flashcard.id == update_req.flashcard_id).first()
+        flashcard = db.query(Flashcard).filter(Flashcard.id == flashcard_id).first()
         if not flashcard:
-            raise HTTPException(status_code=404, detail="Flashcard not found")
+            return None
         
-        flashcard.update_review(update_req.was_correct)
+        flashcard.update_review(was_correct)
         db.commit()
+        get_all_sessions_stats.cache_clear()
         
         return {
             "success": True,
@@ -381,42 +577,56 @@ async def review_flashcard(request: Request, update_req: FlashcardUpdateRequest)
             "times_correct": flashcard.times_correct,
             "next_review": flashcard.next_review.isoformat() if flashcard.next_review else None
         }
-    except Exception as e:
+    except Exception:
         db.rollback()
+        raise
+
+
+@app.post("/api/v1/flashcard/review")
+@limiter.limit(RATE_LIMIT_FAST)
+async def review_flashcard(
+    request: Request,
+    update_req: FlashcardUpdateRequest,
+    db: Session = Depends(get_db)
+):
+    """Update flashcard statistics after a review."""
+    try:
+        result = await asyncio.to_thread(
+            _review_flashcard, db, update_req.flashcard_id, update_req.was_correct
+        )
+    except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
+    
+    if result is None:
+        raise HTTPException(status_code=404, detail="Flashcard not found")
+    return result
 
 
 # ============ Study Materials Endpoint ============
 
+async def _get_study_context(session_id: Optional[str], max_chunks: int = 15) -> str:
+    """Retrieve and combine context chunks for study material generation."""
+    documents, _ = await _study_chunks(session_id)
+    
+    if not documents:
+        raise HTTPException(status_code=404, detail="No context found")
+    
+    return "\n\n".join(documents[:max_chunks])
+
+
 @app.post("/api/v1/generate/materials")
-@limiter.limit("5/minute")
+@limiter.limit(RATE_LIMIT_GENERATE)
 async def generate_study_materials(request: Request, materials_req: StudyMaterialRequest):
     """Generate comprehensive study materials from screen content."""
     groq = get_groq_service()
     
     try:
-        # Retrieve context
-        if materials_req.session_id:
-            results = query_by_session(materials_req.session_id, n_results=50)
-        else:
-            results = collection.query(
-                query_texts=["study material, concepts, key points"],
-                n_results=50
-            )
-        
-        documents = results.get("documents", [[]])[0]
-        
-        if not documents:
-            raise HTTPException(status_code=404, detail="No context found")
-        
-        combined_context = "\n\n".join(documents[:15])
+        combined_context = await _get_study_context(materials_req.session_id)
         
         if not groq.is_available:
             raise HTTPException(status_code=503, detail="Groq API not configured")
         
-        groq_response = groq.generate_study_materials(context=combined_context)
+        groq_response = await groq.agenerate_study_materials(context=combined_context)
         
         if not groq_response.success:
             raise HTTPException(status_code=500, detail=f"Groq error: {groq_response.error}")
@@ -434,20 +644,63 @@ async def generate_study_materials(request: Request, materials_req: StudyMateria
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/v1/generate/materials/stream")
+@limiter.limit(RATE_LIMIT_GENERATE)
+async def stream_study_materials(request: Request, materials_req: StudyMaterialRequest):
+    """
+    Stream study materials as Server-Sent Events.
+    Emits {"delta": ...} events as tokens arrive, then a final {"done": true, ...} event.
+    """
+    groq = get_groq_service()
+    
+    try:
+        combined_context = await _get_study_context(materials_req.session_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    if not groq.is_available:
+        raise HTTPException(status_code=503, detail="Groq API not configured")
+    
+    async def event_stream():
+        stream = groq.astream_study_materials(context=combined_context)
+        # aclosing() closes the upstream Groq stream as soon as we stop reading
+        async with aclosing(stream):
+            async for item in stream:
+                if isinstance(item, GroqResponse):
+                    event = {
+                        "done": True,
+                        "success": item.success,
+                        "format": "markdown",
+                        "model": item.model,
+                        "usage": item.usage,
+                        "error": item.error
+                    }
+                else:
+                    if await request.is_disconnected():
+                        print("[Materials] Client disconnected, aborting stream")
+                        return
+                    event = {"delta": item}
+                yield b"data: " + orjson.dumps(event) + b"\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 # ============ Statistics Endpoints ============
 
 @app.get("/api/v1/stats")
-@limiter.limit("20/minute")
+@limiter.limit(RATE_LIMIT_READ)
 async def get_stats(request: Request, session_id: Optional[str] = Query(None)):
     """Get study statistics."""
     try:
         if session_id:
-            stats = get_session_stats(session_id)
+            stats = await asyncio.to_thread(get_session_stats, session_id)
             if not stats:
                 raise HTTPException(status_code=404, detail="Session not found")
             return stats
         else:
-            return {"sessions": get_all_sessions_stats()}
+            return {"sessions": await asyncio.to_thread(get_all_sessions_stats)}
     except HTTPException:
         raise
     except Exception as e:
@@ -455,29 +708,49 @@ async def get_stats(request: Request, session_id: Optional[str] = Query(None)):
 
 
 @app.get("/api/v1/sessions")
-@limiter.limit("20/minute")
+@limiter.limit(RATE_LIMIT_READ)
 async def get_sessions(request: Request):
     """Get all session IDs."""
     try:
-        session_ids = get_session_ids()
+        session_ids = await asyncio.to_thread(get_session_ids)
         return {"sessions": session_ids}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/v1/cache/stats")
+@limiter.limit(RATE_LIMIT_READ)
+async def get_cache_stats(request: Request):
+    """Get query result cache statistics."""
+    return get_query_cache().stats()
+
+
+# ============ Health Endpoints ============
+
+@app.get("/ready")
+async def ready(request: Request):
+    """Readiness probe: 503 until the vision model has loaded."""
+    if not request.app.state.model_loaded:
+        raise HTTPException(status_code=503, detail="Vision model loading")
+    return {"ready": True}
+
+
 # ============ Screen Analysis Endpoint (with buffering) ============
 
 @app.post("/analyze")
-@limiter.limit("30/minute")
+@limiter.limit(RATE_LIMIT_FAST)
 async def analyze_endpoint(request: Request, file: UploadFile = File(...), prompt: str = "Describe this image."):
     """Analyze a screen frame and add to ingestion buffer."""
+    await request.app.state.model_ready.wait()
+    if not request.app.state.model_loaded:
+        raise HTTPException(status_code=503, detail="Vision model unavailable")
+    
     try:
         contents = await file.read()
-        loop = asyncio.get_event_loop()
-        text = await loop.run_in_executor(None, analyze_image, contents, prompt)
+        text = await vision_batcher.submit(contents, prompt)
         
         # Add to ingestion buffer for batched embedding
-        add_to_buffer(frame_description=text)
+        await add_to_buffer(frame_description=text)
         
         return {"result": text, "buffered": True}
     except Exception as e:
@@ -494,11 +767,11 @@ async def websocket_endpoint(websocket: WebSocket):
 # ============ Manual Flush Endpoint ============
 
 @app.post("/api/v1/ingestion/flush")
-@limiter.limit("5/minute")
+@limiter.limit(RATE_LIMIT_GENERATE)
 async def flush_ingestion_buffer(request: Request):
     """Manually flush the ingestion buffer (for testing)."""
     try:
-        await ingestion_buffer.process_current_batch()
+        await ingestion_buffer.process_current_batch(force=True)
         return {"success": True, "message": "Buffer flushed"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1,47 +1,132 @@
 from faster_whisper import WhisperModel
 import numpy as np
+import os
+import threading
+import time
+from functools import lru_cache
 
 # Switched to distil-small.en for much better accuracy with numbers and continuous speech
 # It is still fast enough for real-time on modern CPUs
-model = WhisperModel("distil-small.en", device="cpu", compute_type="int8")
+# WHISPER_MODEL also accepts a local CTranslate2 conversion directory.
+# CTranslate2 has no 4-bit weights; int8 is its smallest CPU compute type.
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "distil-small.en")
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+# faster-whisper defaults to 4 intra-op threads; use every core instead
+WHISPER_CPU_THREADS = int(os.getenv("WHISPER_CPU_THREADS", os.cpu_count() or 4))
 
+# lru_cache alone would let a startup preload and a first transcription both load
+_load_lock = threading.Lock()
 
-def _convert_audio_to_float(audio_bytes: bytes) -> np.ndarray:
-    """Convert Int16 PCM bytes to normalized Float32 array [-1, 1]."""
+
+@lru_cache(maxsize=1)
+def _load_whisper_model(name: str) -> WhisperModel:
+    print(f"[STT] Loading {name} ({WHISPER_COMPUTE_TYPE}, {WHISPER_CPU_THREADS} threads)", flush=True)
+    return WhisperModel(
+        name,
+        device="cpu",
+        compute_type=WHISPER_COMPUTE_TYPE,
+        cpu_threads=WHISPER_CPU_THREADS,
+        num_workers=1  # One model replica; concurrent transcriptions queue on it
+    )
+
+
+def get_whisper_model(name: str = WHISPER_MODEL) -> WhisperModel:
+    """Load the Whisper model on first use and reuse it afterwards."""
+    with _load_lock:
+        return _load_whisper_model(name)
+
+
+def warm_up_whisper_model():
+    """
+    Load the model and run one short silent decode, so CTranslate2's kernels
+    and allocator are initialised before the first real audio window.
+    """
+    start = time.perf_counter()
+    try:
+        # VAD off: Silero would drop pure silence before it reached the decoder
+        segments, _ = get_whisper_model().transcribe(
+            np.zeros(16000, dtype=np.float32),
+            language="en",
+            beam_size=1,
+            vad_filter=False
+        )
+        list(segments)
+        print(f"[STT] Model warm after {time.perf_counter() - start:.2f}s", flush=True)
+    except Exception as e:
+        print(f"[STT] Warm-up failed: {e}", flush=True)
+
+
+_PCM16_SCALE = np.float32(1.0 / 32768.0)
+
+# Per-thread float32 scratch buffer for pcm16_to_float32(reuse_buffer=True)
+_scratch = threading.local()
+
+
+def pcm16_to_float32(audio_bytes: bytes | bytearray, reuse_buffer: bool = False) -> np.ndarray:
+    """
+    Convert Int16 PCM bytes to normalized Float32 array [-1, 1].
+
+    faster-whisper's feature extractor runs in NumPy and expects float32
+    samples in [-1, 1], so int16 can't be handed over as-is.
+
+    reuse_buffer=True writes into a per-thread scratch buffer instead of a
+    fresh array; the result is only valid until the next such call on the
+    same thread.
+    """
     audio_int16 = np.frombuffer(audio_bytes, dtype=np.int16)
-    return audio_int16.astype(np.float32) / 32768.0
+    if not reuse_buffer:
+        # Convert and scale in one pass into a single float32 output buffer
+        return np.multiply(audio_int16, _PCM16_SCALE, dtype=np.float32)
+
+    buffer = getattr(_scratch, "buffer", None)
+    if buffer is None or buffer.size < audio_int16.size:
+        buffer = _scratch.buffer = np.empty(audio_int16.size, dtype=np.float32)
+    out = buffer[:audio_int16.size]
+    np.multiply(audio_int16, _PCM16_SCALE, out=out, dtype=np.float32)
+    return out
 
 
-def _transcribe_segments(audio_data: np.ndarray):
-    """Common transcription logic for both functions."""
-    segments, info = model.transcribe(
+def _transcribe_segments(audio_data: np.ndarray, streaming: bool = False):
+    """
+    Common transcription logic for both functions.
+
+    streaming=True decodes greedily for rolling windows that will be
+    re-transcribed anyway; the default beam search is kept for final passes.
+    """
+    beam_size = 1 if streaming else 5
+    segments, info = get_whisper_model().transcribe(
         audio_data,
         language="en",
-        beam_size=5,
-        best_of=5,
+        beam_size=beam_size,
+        best_of=beam_size,
         temperature=0.0,
+        condition_on_previous_text=not streaming,
+        vad_filter=True,  # Silero VAD skips silent stretches inside the window
+        vad_parameters={"min_silence_duration_ms": 300},
     )
     return list(segments)
 
 
-def transcribe_audio_buffer(audio_bytes: bytes):
+def transcribe_audio_buffer(audio_bytes: bytes, streaming: bool = False):
     """
     Expects: Raw 16kHz Mono Int16 PCM bytes.
     Returns: Transcribed text string.
     """
-    audio_data = _convert_audio_to_float(audio_bytes)
-    segments = _transcribe_segments(audio_data)
+    # Safe to reuse: segments are fully decoded before this thread converts again
+    audio_data = pcm16_to_float32(audio_bytes, reuse_buffer=True)
+    segments = _transcribe_segments(audio_data, streaming)
     text = " ".join([segment.text for segment in segments]).strip()
     return text
 
 
-def transcribe_audio_buffer_with_timestamps(audio_bytes: bytes):
+def transcribe_audio_buffer_with_timestamps(audio_bytes: bytes, streaming: bool = False):
     """
     Expects: Raw 16kHz Mono Int16 PCM bytes.
     Returns: Tuple of (full_text, segments_list, end_time)
     """
-    audio_data = _convert_audio_to_float(audio_bytes)
-    segments = _transcribe_segments(audio_data)
+    # Safe to reuse: segments are fully decoded before this thread converts again
+    audio_data = pcm16_to_float32(audio_bytes, reuse_buffer=True)
+    segments = _transcribe_segments(audio_data, streaming)
 
     if not segments:
         return "", [], 0.0
@@ -0,0 +1,115 @@
+"""
+ChromaDB Query Micro-Batcher
+
+Coalesces concurrent vector searches into multi-query collection.query
+calls: requests queued within a short window share one round-trip and
+one HNSW traversal pass.
+"""
+
+import asyncio
+from typing import Optional
+
+import orjson
+
+QUERY_BATCH_WAIT_SEC = 0.01
+QUERY_BATCH_MAX_SIZE = 16  # Caps how long one slow batch can hold up later requests
+
+# Per-query result fields of a collection.query() response
+_RESULT_FIELDS = ("ids", "embeddings", "documents", "metadatas", "distances")
+
+
+class QueryBatcher:
+    """
+    Queue of pending (embedding, n_results, where, include) searches.
+
+    A worker task drains the queue every QUERY_BATCH_WAIT_SEC (or once
+    QUERY_BATCH_MAX_SIZE requests are waiting) and issues one
+    collection.query per distinct (where, include) combination.
+    """
+
+    def __init__(
+        self,
+        collection,
+        max_wait_sec: float = QUERY_BATCH_WAIT_SEC,
+        max_batch_size: int = QUERY_BATCH_MAX_SIZE
+    ):
+        self.collection = collection
+        self.max_wait_sec = max_wait_sec
+        self.max_batch_size = max_batch_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def submit(
+        self,
+        embedding: list[float],
+        n_results: int,
+        where: Optional[dict] = None,
+        include: tuple[str, ...] = ("documents", "metadatas", "distances")
+    ) -> dict:
+        """
+        Queue a search and wait for its result.
+
+        Returns:
+            A single-query collection.query() result (fields nested one level)
+        """
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((embedding, n_results, where, tuple(include), future))
+        return await future
+
+    def stop(self):
+        """Cancel the worker task."""
+        if self._worker:
+            self._worker.cancel()
+            self._worker = None
+
+    async def _run(self):
+        """Collect requests for up to max_wait_sec, then run them as one batch."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait_sec
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # One query call can only carry one where clause and include list
+            groups = {}
+            for request in batch:
+                key = (orjson.dumps(request[2], option=orjson.OPT_SORT_KEYS), request[3])
+                groups.setdefault(key, []).append(request)
+
+            await asyncio.gather(*(self._query_group(group) for group in groups.values()))
+
+    async def _query_group(self, group: list[tuple]):
+        """Run one multi-query call and hand each caller its slice."""
+        _, _, where, include, _ = group[0]
+        try:
+            results = await asyncio.to_thread(
+                self.collection.query,
+                query_embeddings=[request[0] for request in group],
+                n_results=max(request[1] for request in group),
+                where=where,
+                include=list(include)
+            )
+        except Exception as e:
+            for request in group:
+                if not request[4].done():
+                    request[4].set_exception(e)
+            return
+
+        for i, (_, n_results, _, _, future) in enumerate(group):
+            if future.done():
+                continue  # Caller gave up
+            future.set_result({
+                field: None if results.get(field) is None else [results[field][i][:n_results]]
+                for field in _RESULT_FIELDS
+            })
@@ -0,0 +1,135 @@
+"""
+Query Result Cache
+
+In-process LRU + TTL cache of ChromaDB query results, keyed by
+(endpoint, query_text, session_id, n_results). Invalidated whenever the
+collection is written to, so repeated questions skip the ANN search.
+
+Also provides ttl_cache, a memoiser for cheap-to-stale listing queries.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Callable, Optional
+
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 512))
+QUERY_CACHE_TTL_SEC = float(os.getenv("QUERY_CACHE_TTL_SEC", 300))
+
+# (endpoint, query_text, session_id, n_results): the endpoint tag keeps
+# differently shaped results for the same search apart
+CacheKey = tuple[str, str, Optional[str], int]
+
+
+class QueryCache:
+    """Thread-safe LRU cache with per-entry expiry and hit/miss counters."""
+
+    def __init__(self, max_size: int = QUERY_CACHE_SIZE, ttl_sec: float = QUERY_CACHE_TTL_SEC):
+        self.max_size = max_size
+        self.ttl_sec = ttl_sec
+        self._entries: OrderedDict[CacheKey, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: CacheKey) -> Optional[Any]:
+        """Return the cached result for a key, or None on a miss or expiry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl_sec:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: CacheKey, result: Any):
+        """Store a result, evicting the least recently used entry when full."""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, session_id: Optional[str] = None):
+        """
+        Drop entries that a write may have made stale.
+
+        Args:
+            session_id: Session that was written to; global (unfiltered) entries
+                are always dropped. None clears the whole cache.
+        """
+        with self._lock:
+            if session_id is None:
+                self._entries.clear()
+                return
+
+            for key in [k for k in self._entries if k[2] is None or k[2] == session_id]:
+                del self._entries[key]
+
+    def invalidate_all(self):
+        """Clear the whole cache."""
+        self.invalidate()
+
+    def stats(self) -> dict:
+        """Hit/miss counters for monitoring."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_sec": self.ttl_sec,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+
+# Global query cache instance
+query_cache = QueryCache()
+
+
+def get_query_cache() -> QueryCache:
+    """Get the global query cache instance."""
+    return query_cache
+
+
+def ttl_cache(seconds: float) -> Callable:
+    """
+    Memoise a function's result per argument tuple for `seconds`.
+
+    The wrapped function gains cache_clear() for writers that know the
+    result has changed.
+    """
+    def decorator(func: Callable) -> Callable:
+        entries: dict[tuple, tuple[float, Any]] = {}
+        lock = threading.Lock()
+
+        @wraps(func)
+        def wrapper(*args):
+            with lock:
+                entry = entries.get(args)
+                if entry is not None and time.monotonic() - entry[0] < seconds:
+                    return entry[1]
+
+            result = func(*args)
+            with lock:
+                entries[args] = (time.monotonic(), result)
+            return result
+
+        def cache_clear():
+            with lock:
+                entries.clear()
+
+        wrapper.cache_clear = cache_clear
+        return wrapper
+
+    return decorator
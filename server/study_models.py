@@ -5,26 +5,46 @@ Stores study sessions, flashcards, and user performance data.
 Uses SQLite for lightweight local storage.
 """
 
-from sqlalchemy import create_engine, Column, String, Integer, Float, DateTime, ForeignKey, Text, Boolean
+from sqlalchemy import create_engine, event, case, func, Column, Index, String, Integer, Float, DateTime, ForeignKey, Text, Boolean
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
-from datetime import datetime
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from datetime import datetime, timezone
+from typing import Optional
 import os
 
+from query_cache import ttl_cache
+
 # Database setup
 current_dir = os.path.dirname(os.path.abspath(__file__))
 db_path = os.path.join(current_dir, "study_data.db")
 
 engine = create_engine(f"sqlite:///{db_path}", echo=False)
+
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL lets readers proceed while a write is in progress; NORMAL sync is safe under WAL."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 
+def utc_now() -> datetime:
+    """Current UTC time as a naive datetime, the form every DateTime column stores."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 class StudySession(Base):
     """Represents a study session with aggregated context chunks."""
     __tablename__ = "study_sessions"
     
     id = Column(String, primary_key=True, index=True)
-    start_time = Column(DateTime, nullable=False, default=datetime.utcnow)
+    start_time = Column(DateTime, nullable=False, default=utc_now)
     end_time = Column(DateTime, nullable=True)
     total_chunks = Column(Integer, default=0)
     total_flashcards = Column(Integer, default=0)
@@ -38,7 +58,7 @@ class StudySession(Base):
     def duration_minutes(self) -> float:
         """Calculate session duration in minutes."""
         if not self.end_time:
-            end = datetime.utcnow()
+            end = utc_now()
         else:
             end = self.end_time
         return (end - self.start_time).total_seconds() / 60.0
@@ -66,6 +86,12 @@ class Flashcard(Base):
     # Relationships
     session = relationship("StudySession", back_populates="flashcards")
     
+    # Stats aggregate per session; due-card lookups scan a session by next_review
+    __table_args__ = (
+        Index("ix_flashcard_session_difficulty", "session_id", "difficulty"),
+        Index("ix_flashcard_session_next_review", "session_id", "next_review"),
+    )
+    
     @property
     def success_rate(self) -> float:
         """Calculate success rate as percentage."""
@@ -90,9 +116,9 @@ class Flashcard(Base):
             self.interval_days = 1
             self.ease_factor = max(1.3, self.ease_factor - 0.2)
         
-        self.last_reviewed = datetime.utcnow()
+        self.last_reviewed = utc_now()
         if self.next_review is None:
-            self.next_review = datetime.utcnow()
+            self.next_review = utc_now()
         # Recalculate next review date based on interval
 
 
@@ -120,6 +146,16 @@ class UserPerformance(Base):
             pass
 
 
+class IngestedSession(Base):
+    """Registry of session IDs seen by the ingestion pipeline (one row per session)."""
+    __tablename__ = "ingested_sessions"
+    
+    id = Column(String, primary_key=True, index=True)
+    first_seen = Column(DateTime, nullable=False)
+    last_seen = Column(DateTime, nullable=False, index=True)
+    chunk_count = Column(Integer, default=0)
+
+
 # Helper functions
 def get_db():
     """Get database session (for FastAPI dependency injection)."""
@@ -133,45 +169,122 @@ def get_db():
 def init_db():
     """Initialize database tables."""
     Base.metadata.create_all(bind=engine)
+    # create_all skips tables that already exist, so add indexes introduced later
+    for index in Flashcard.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
     print("[Database] SQLite tables created")
 
 
-def get_session_stats(session_id: str) -> dict:
-    """Get statistics for a specific session."""
-    db = SessionLocal()
-    try:
-        session = db.query(StudySession).filter(StudySession.id == session_id).first()
-        if not session:
-            return {}
-        
-        flashcards = db.query(Flashcard).filter(Flashcard.session_id == session_id).all()
-        performance = db.query(UserPerformance).filter(UserPerformance.session_id == session_id).first()
-        
-        total_reviewed = sum(fc.times_reviewed for fc in flashcards)
-        total_correct = sum(fc.times_correct for fc in flashcards)
-        
-        return {
-            "session_id": session_id,
+def _sessions_stats(db, session_id: Optional[str] = None) -> list[dict]:
+    """
+    Statistics for one session (or all, newest first), aggregated in SQLite.
+
+    One outer-joined GROUP BY returns every session with its flashcard
+    counters and one more query its distinct topics, instead of loading
+    each session's flashcards.
+    """
+    rows = db.query(
+        StudySession,
+        func.count(Flashcard.id),
+        func.coalesce(func.sum(Flashcard.times_reviewed), 0),
+        func.coalesce(func.sum(Flashcard.times_correct), 0),
+        func.sum(case((Flashcard.difficulty == "easy", 1), else_=0)),
+        func.sum(case((Flashcard.difficulty == "medium", 1), else_=0)),
+        func.sum(case((Flashcard.difficulty == "hard", 1), else_=0))
+    ).outerjoin(Flashcard, Flashcard.session_id == StudySession.id).group_by(StudySession.id)
+    
+    topics_query = db.query(Flashcard.session_id, Flashcard.topic).filter(
+        Flashcard.topic.isnot(None),
+        Flashcard.topic != ""
+    ).distinct()
+    
+    if session_id:
+        rows = rows.filter(StudySession.id == session_id)
+        topics_query = topics_query.filter(Flashcard.session_id == session_id)
+    else:
+        rows = rows.order_by(StudySession.start_time.desc())
+    
+    topics = {}
+    for topic_session_id, topic in topics_query:
+        topics.setdefault(topic_session_id, []).append(topic)
+    
+    return [
+        {
+            "session_id": session.id,
             "duration_minutes": round(session.duration_minutes, 2),
-            "total_flashcards": len(flashcards),
+            "total_flashcards": total,
             "flashcards_reviewed": total_reviewed,
             "accuracy_rate": round((total_correct / total_reviewed * 100) if total_reviewed > 0 else 0, 2),
-            "topics_covered": list(set(fc.topic for fc in flashcards if fc.topic)),
+            "topics_covered": topics.get(session.id, []),
             "difficulty_distribution": {
-                "easy": sum(1 for fc in flashcards if fc.difficulty == "easy"),
-                "medium": sum(1 for fc in flashcards if fc.difficulty == "medium"),
-                "hard": sum(1 for fc in flashcards if fc.difficulty == "hard")
+                "easy": easy,
+                "medium": medium,
+                "hard": hard
             }
         }
+        for session, total, total_reviewed, total_correct, easy, medium, hard in rows
+    ]
+
+
+def get_session_stats(session_id: str) -> dict:
+    """Get statistics for a specific session."""
+    db = SessionLocal()
+    try:
+        stats = _sessions_stats(db, session_id)
+        return stats[0] if stats else {}
     finally:
         db.close()
 
 
+@ttl_cache(seconds=10)
 def get_all_sessions_stats() -> list:
     """Get statistics for all sessions."""
     db = SessionLocal()
     try:
-        sessions = db.query(StudySession).order_by(StudySession.start_time.desc()).all()
-        return [get_session_stats(session.id) for session in sessions]
+        return _sessions_stats(db)
+    finally:
+        db.close()
+
+
+def record_session_chunk(session_id: str, start_time: datetime, end_time: datetime, chunks: int = 1):
+    """Upsert the session registry after chunks are embedded."""
+    db = SessionLocal()
+    try:
+        stmt = sqlite_insert(IngestedSession).values(
+            id=session_id,
+            first_seen=start_time,
+            last_seen=end_time,
+            chunk_count=chunks
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[IngestedSession.id],
+            set_={
+                "last_seen": end_time,
+                "chunk_count": IngestedSession.chunk_count + chunks
+            }
+        )
+        db.execute(stmt)
+        db.commit()
+        get_ingested_session_ids.cache_clear()
+    finally:
+        db.close()
+
+
+@ttl_cache(seconds=10)
+def get_ingested_session_ids() -> list:
+    """Get all ingested session IDs, most recently active first."""
+    db = SessionLocal()
+    try:
+        rows = db.query(IngestedSession.id).order_by(IngestedSession.last_seen.desc()).all()
+        return [row.id for row in rows]
+    finally:
+        db.close()
+
+
+def has_ingested_sessions() -> bool:
+    """Check whether the session registry has any rows."""
+    db = SessionLocal()
+    try:
+        return db.query(IngestedSession.id).first() is not None
     finally:
         db.close()
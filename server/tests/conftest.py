@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Server modules are imported as top-level modules (python main.py layout)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,36 @@
+"""
+Collections persisted before SharedSTEmbeddingFunction existed were created
+with Chroma's SentenceTransformerEmbeddingFunction; they must still open.
+"""
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("sentence_transformers")
+
+import chromadb
+from chromadb.utils.embedding_functions import SentenceTransformerEmbeddingFunction
+
+from embeddings import EMBEDDING_MODEL_NAME, SharedSTEmbeddingFunction, get_embedding_store
+
+
+def test_reopens_collection_persisted_with_sentence_transformer_function(tmp_path):
+    client = chromadb.PersistentClient(path=str(tmp_path))
+    legacy = client.get_or_create_collection(
+        name="embedding_storage",
+        embedding_function=SentenceTransformerEmbeddingFunction(model_name=EMBEDDING_MODEL_NAME),
+        metadata={"hnsw:space": "ip"}
+    )
+    legacy.add(ids=["legacy"], documents=["stored before the upgrade"])
+
+    client = chromadb.PersistentClient(path=str(tmp_path))
+    collection = client.get_or_create_collection(
+        name="embedding_storage",
+        embedding_function=SharedSTEmbeddingFunction(get_embedding_store()),
+        metadata={"hnsw:space": "ip"}
+    )
+    collection.add(ids=["new"], documents=["stored after the upgrade"])
+
+    assert collection.count() == 2
+    result = collection.query(query_texts=["stored before the upgrade"], n_results=1)
+    assert result["ids"][0] == ["legacy"]
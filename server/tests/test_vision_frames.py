@@ -0,0 +1,54 @@
+"""
+FrameChatHandler hands frames to Moondream through the chat handler's
+load_image() hook; handlers without it must still get data URIs.
+"""
+
+import types
+
+import pytest
+
+pytest.importorskip("llama_cpp")
+
+import vision
+from vision import FrameChatHandler
+
+JPEG = b"\xff\xd8\xff\xe0fake-jpeg"
+
+
+def _fake_model(chat_handler, seen_urls):
+    def create_chat_completion(messages, **kwargs):
+        url = messages[0]["content"][0]["image_url"]["url"]
+        seen_urls.append(url)
+        if isinstance(chat_handler, FrameChatHandler):
+            assert chat_handler.load_image(url) == JPEG
+        return {"choices": [{"message": {"content": " a screen "}}]}
+
+    return types.SimpleNamespace(chat_handler=chat_handler, create_chat_completion=create_chat_completion)
+
+
+def _frame_handler():
+    # Skip __init__: it loads the projector model from disk
+    handler = FrameChatHandler.__new__(FrameChatHandler)
+    handler.frames = {}
+    return handler
+
+
+def test_installed_llama_cpp_exposes_load_image_hook():
+    assert vision._HANDLER_LOADS_IMAGES
+
+
+def test_frames_are_served_from_memory(monkeypatch):
+    handler, seen = _frame_handler(), []
+    monkeypatch.setattr(vision, "model", _fake_model(handler, seen))
+
+    assert vision._describe(memoryview(JPEG), "Describe.") == "a screen"
+    assert seen[0].startswith("frame://")
+    assert handler.frames == {}
+
+
+def test_handler_without_hook_gets_a_data_uri(monkeypatch):
+    seen = []
+    monkeypatch.setattr(vision, "model", _fake_model(object(), seen))
+
+    assert vision._describe(JPEG, "Describe.") == "a screen"
+    assert seen[0].startswith("data:image/jpeg;base64,")
@@ -1,17 +1,53 @@
 from llama_cpp import Llama
 from llama_cpp.llama_chat_format import MoondreamChatHandler
+from collections import OrderedDict
+from itertools import count
 import os
 import base64
+import hashlib
+import threading
 
 model = None
 
+# Text model file under models/. A Q4_K_M/Q5_K_M quantization of the f16 file
+# (see README) reads about a third of the weight bytes per generated token.
+VISION_TEXT_MODEL = os.getenv("VISION_TEXT_MODEL", "moondream2-text-model-f16_ct-vicuna.gguf")
+# Pin the mmapped weights in RAM so they are never paged out (needs RLIMIT_MEMLOCK)
+VISION_MLOCK = os.getenv("VISION_MLOCK", "false").lower() == "true"
+
+# Screen frames often repeat (a slide left up); remember recent descriptions
+# keyed on a 128-bit hash of the image bytes and the prompt
+VISION_CACHE_SIZE = int(os.getenv("VISION_CACHE_SIZE", 256))
+_description_cache: OrderedDict[bytes, str] = OrderedDict()
+_cache_lock = threading.Lock()
+
+_FRAME_URL_SCHEME = "frame://"
+_frame_ids = count()
+
+# FrameChatHandler relies on the handler loading every image through its
+# load_image() method; on llama-cpp-python builds without that hook, frames
+# fall back to base64 data URIs
+_HANDLER_LOADS_IMAGES = callable(getattr(MoondreamChatHandler, "load_image", None))
+
+class FrameChatHandler(MoondreamChatHandler):
+    """Moondream handler that also reads images registered in `frames` by URL."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.frames: dict[str, bytes | memoryview] = {}
+
+    def load_image(self, image_url: str) -> bytes | memoryview:
+        if image_url.startswith(_FRAME_URL_SCHEME):
+            return self.frames[image_url]
+        return super().load_image(image_url)
+
 def load_model():
     global model
 
     current_dir = os.path.dirname(os.path.abspath(__file__))
     base_path = os.path.join(current_dir, "models")
 
-    model_path = os.path.join(base_path, "moondream2-text-model-f16_ct-vicuna.gguf")
+    model_path = os.path.join(base_path, VISION_TEXT_MODEL)
     projector_path = os.path.join(base_path, "moondream2-mmproj-f16-20250414.gguf")
 
     print(f"🔍 Looking for models in: {base_path}", flush=True)
@@ -24,7 +60,8 @@ def load_model():
         raise FileNotFoundError(f"Vision adapter not found: {projector_path}")
 
     print(f"⏳ Loading Moondream chat handler...", flush=True)
-    chat_handler = MoondreamChatHandler(
+    handler_class = FrameChatHandler if _HANDLER_LOADS_IMAGES else MoondreamChatHandler
+    chat_handler = handler_class(
         clip_model_path=projector_path,
         verbose=False
     )
@@ -37,7 +74,9 @@ def load_model():
             model_path=model_path,
             chat_handler=chat_handler,
             n_ctx=2048,
+            n_batch=512,
             n_gpu_layers=-1,  # Offload all layers to GPU
+            use_mlock=VISION_MLOCK,
             verbose=False
         )
         print(f"✅ Model loaded on GPU successfully", flush=True)
@@ -47,35 +86,67 @@ def load_model():
             model_path=model_path,
             chat_handler=chat_handler,
             n_ctx=2048,
+            n_batch=512,
             n_gpu_layers=0,  # CPU only
+            use_mlock=VISION_MLOCK,
             verbose=False
         )
         print(f"✅ Model loaded on CPU", flush=True)
 
     return model
 
-def analyze_image(image_bytes: bytes, prompt: str = "Describe this image."):
+def _cache_key(image_bytes: bytes | memoryview, prompt: str) -> bytes:
+    digest = hashlib.blake2b(image_bytes, digest_size=16)
+    digest.update(prompt.encode())
+    return digest.digest()
+
+def analyze_image(image_bytes: bytes | memoryview, prompt: str = "Describe this image.", cache: bool = True):
     if model is None:
         raise Exception("Vision model not loaded")
 
-    # Convert image to base64 data URI (auto-detect format)
-    # Check JPEG magic bytes (FF D8 FF)
-    if image_bytes[:3] == b'\xff\xd8\xff':
-        mime_type = "image/jpeg"
-    else:
-        # Default to PNG
-        mime_type = "image/png"
-    
-    image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-    data_uri = f"data:{mime_type};base64,{image_base64}"
+    if cache:
+        key = _cache_key(image_bytes, prompt)
+        with _cache_lock:
+            if key in _description_cache:
+                _description_cache.move_to_end(key)
+                return _description_cache[key]
+
+    description = _describe(image_bytes, prompt)
 
+    if cache:
+        with _cache_lock:
+            _description_cache[key] = description
+            while len(_description_cache) > VISION_CACHE_SIZE:
+                _description_cache.popitem(last=False)
+
+    return description
+
+def _data_uri(image_bytes: bytes | memoryview) -> str:
+    # Check JPEG magic bytes (FF D8 FF), default to PNG
+    mime_type = "image/jpeg" if image_bytes[:3] == b'\xff\xd8\xff' else "image/png"
+    return f"data:{mime_type};base64,{base64.b64encode(image_bytes).decode('utf-8')}"
+
+def _describe(image_bytes: bytes | memoryview, prompt: str) -> str:
+    if not isinstance(model.chat_handler, FrameChatHandler):
+        return _complete(_data_uri(image_bytes), prompt)
+
+    # Hand the frame over in memory under a short URL instead of a base64 data
+    # URI: the handler renders the URL into the prompt text and would decode it again
+    image_url = f"{_FRAME_URL_SCHEME}{next(_frame_ids)}"
+    model.chat_handler.frames[image_url] = image_bytes
+    try:
+        return _complete(image_url, prompt)
+    finally:
+        del model.chat_handler.frames[image_url]
+
+def _complete(image_url: str, prompt: str) -> str:
     # Use chat completion with Moondream handler
     output = model.create_chat_completion(
         messages=[
             {
                 "role": "user",
                 "content": [
-                    {"type": "image_url", "image_url": {"url": data_uri}},
+                    {"type": "image_url", "image_url": {"url": image_url}},
                     {"type": "text", "text": prompt}
                 ]
             }
@@ -85,3 +156,17 @@ def analyze_image(image_bytes: bytes, prompt: str = "Describe this image."):
     )
 
     return output["choices"][0]["message"]["content"].strip()
+
+def analyze_image_batch(images: list[bytes | memoryview], prompts: list[str]) -> list[str]:
+    """
+    Describe a group of frames in one executor hop.
+
+    llama.cpp evaluates one sequence at a time on the shared context, so frames
+    run back to back; identical (image, prompt) pairs are only evaluated once.
+    """
+    results = {}
+    for image_bytes, prompt in zip(images, prompts):
+        if (image_bytes, prompt) not in results:
+            results[(image_bytes, prompt)] = analyze_image(image_bytes, prompt)
+
+    return [results[(image_bytes, prompt)] for image_bytes, prompt in zip(images, prompts)]
